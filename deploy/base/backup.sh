@@ -1,9 +1,10 @@
 #!/bin/bash
 #
-# Backup current sqlite db to another folder.
+# Backup current sqlite db to another folder (consistently, while the site is running), optionally only keeping a
+# number of the most recent backups (only timestamped backups made by `backup_db` are removed, not e.g. older copies).
 #
-# Example:
-# ./backup.sh ~/backups rankings/db.sqlite3
+# Example (keeping the 30 most recent backups):
+# ./backup.sh ~/backups rankings/db.sqlite3 30
 
 # Location of this script file
 SCRIPTPATH=$( cd $(dirname $0) ; pwd -P )
@@ -11,8 +12,13 @@ SCRIPTPATH=$( cd $(dirname $0) ; pwd -P )
 # Default command-line arguments
 BACKUP_FOLDER=${1:-~/backups}
 DB_FILE=${2:-$SCRIPTPATH/../rankings/db.sqlite3}
+KEEP=${3:-0}
 
-# Generate filename-friendly date and time string
-DATE_STR=`date -Ins | tr : -`
+# Resolve relative paths before changing directory
+mkdir -p "$BACKUP_FOLDER"
+BACKUP_FOLDER=$( cd "$BACKUP_FOLDER" ; pwd -P )
+DB_FILE=$( cd "$(dirname "$DB_FILE")" ; pwd -P )/$(basename "$DB_FILE")
 
-cp $DB_FILE $BACKUP_FOLDER/`basename $DB_FILE`.$DATE_STR
\ No newline at end of file
+. ~/.profile
+cd ~/rankings-django/rankings
+poetry run python manage.py backup_db "$BACKUP_FOLDER" --source "$DB_FILE" --compress --keep "$KEEP"
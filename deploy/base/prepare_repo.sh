@@ -7,4 +7,5 @@ pip install -r requirements.txt
 cd rankings
 python manage.py migrate
 python manage.py collectstatic
+python manage.py precompile_templates
 cd ..
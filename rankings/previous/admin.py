@@ -7,19 +7,23 @@ from django.contrib import admin, messages
 from django.http import HttpResponseRedirect
 from django.urls import reverse
 
+from .cache import bump_data_versions
+from .jobs import enqueue_recalculation, enqueue_recalculations_from, find_earliest_validated, is_recalculating
 from .models import (
     Activity,
     AdhocTeam,
     Game,
     GameSession,
+    LeaderboardEntry,
     Player,
     Ranking,
+    RecalculationJob,
     Result,
     SkillHistory,
     SkillType,
     TeamMember,
 )
-from .views import get_common_activity, incremental_update_player_skills
+from .ratings import get_common_activity, incremental_update_player_skills, refresh_leaderboard
 
 
 class ActivityAdmin(admin.ModelAdmin):
@@ -29,40 +33,44 @@ class ActivityAdmin(admin.ModelAdmin):
     actions = [
         "recalc_skill_rankings",
         "recalc_skill_rankings_for_current_calendar_year",
+        "recalc_skill_rankings_for_all_activities",
     ]
 
     def recalc_skill_rankings(self, request, queryset):
-        """Define action to completely clear and recalculate the skill rankings."""
+        """Define action to queue a job to completely clear and recalculate the skill rankings."""
         if queryset.count() > 1:
             self.message_user(
                 request,
                 "Can not update more than one activity at once.",
                 level=messages.constants.WARNING,
             )
-            return None
+            return
 
-        return HttpResponseRedirect(reverse("update_rankings", kwargs={"activity_url": queryset.first().id}))
+        self.queue_recalculation(request, queryset.first())
 
     def recalc_skill_rankings_for_current_calendar_year(self, request, queryset):
-        """Define action to recalculate the skill rankings, but only consider games for the current year."""
+        """Define action to queue a job to recalculate the skill rankings, but only consider games for this year."""
         if queryset.count() > 1:
             self.message_user(
                 request,
                 "Can not update more than one activity at once.",
                 level=messages.constants.WARNING,
             )
-            return None
-
-        return HttpResponseRedirect(
-            reverse(
-                "update_rankings",
-                kwargs={
-                    "activity_url": queryset.first().id,
-                    # TODO: use UTC?
-                    "year": datetime.datetime.now().astimezone().year,
-                },
-            )
-        )
+            return
+
+        # TODO: use UTC?
+        year = datetime.datetime.now().astimezone().year
+        self.queue_recalculation(request, queryset.first(), datetime.date(year, 1, 1))
+
+    def recalc_skill_rankings_for_all_activities(self, request, queryset):
+        """Define action to queue a job to recalculate the skill rankings of all activities (in parallel)."""
+        self.queue_recalculation(request, None)
+
+    def queue_recalculation(self, request, activity, after_date=None):
+        """Queue a recalculation job and report where its progress can be followed."""
+        job = enqueue_recalculation(activity, after_date)
+        status_url = reverse("job_status", kwargs={"job_id": job.id})
+        self.message_user(request, f"Recalculation queued as job {job.id} (see: {status_url})")
 
 
 class PlayerAdmin(admin.ModelAdmin):
@@ -76,8 +84,58 @@ class RankingAdmin(admin.ModelAdmin):
 
     list_display = ("__str__",)
 
-
-class GameSessionAdmin(admin.ModelAdmin):
+    def save_model(self, request, obj, form, change):
+        """Save a ranking and update the leaderboard of its activity (and of its previous activity if it changed)."""
+        super().save_model(request, obj, form, change)
+        if change and "activity" in form.changed_data:
+            LeaderboardEntry.objects.filter(ranking=obj).delete()
+            refresh_leaderboard(form.initial["activity"])
+        refresh_leaderboard(obj.activity_id, player_ids=[obj.player_id])
+
+    def delete_model(self, request, obj):
+        """Delete a ranking and update the leaderboard of its activity."""
+        super().delete_model(request, obj)
+        refresh_leaderboard(obj.activity_id)
+
+    def delete_queryset(self, request, queryset):
+        """Delete rankings and update the leaderboards of their activities."""
+        activity_ids = set(queryset.values_list("activity_id", flat=True))
+        super().delete_queryset(request, queryset)
+        for activity_id in activity_ids:
+            refresh_leaderboard(activity_id)
+
+
+class MatchDataAdmin(admin.ModelAdmin):
+    """Admin view for the data of matches, which expires the cached responses of the activities whose data changes."""
+
+    # Lookup of the ID of the activity of an object
+    activity_lookup = "activity_id"
+
+    def get_activity_ids(self, queryset):
+        """Get the IDs of the activities of the given objects."""
+        return set(queryset.values_list(self.activity_lookup, flat=True))
+
+    def save_model(self, request, obj, form, change):
+        """Save an object and expire the responses of its activity (and of its previous activity if it changed)."""
+        objects = self.model.objects.filter(pk=obj.pk)
+        activity_ids = self.get_activity_ids(objects) if change else set()
+        super().save_model(request, obj, form, change)
+        bump_data_versions(activity_ids | self.get_activity_ids(objects))
+
+    def delete_model(self, request, obj):
+        """Delete an object and expire the responses of its activity."""
+        activity_ids = self.get_activity_ids(self.model.objects.filter(pk=obj.pk))
+        super().delete_model(request, obj)
+        bump_data_versions(activity_ids)
+
+    def delete_queryset(self, request, queryset):
+        """Delete objects and expire the responses of their activities."""
+        activity_ids = self.get_activity_ids(queryset)
+        super().delete_queryset(request, queryset)
+        bump_data_versions(activity_ids)
+
+
+class GameSessionAdmin(MatchDataAdmin):
     """Admin view for GameSessions."""
 
     list_display = ("__str__", "result_summary", "validation")
@@ -127,17 +185,36 @@ class GameSessionAdmin(admin.ModelAdmin):
             )
             return
 
+        if is_recalculating(activity.id):
+            # A recalculation replays (and saves) the sessions a chunk at a time, so sessions that are validated
+            # meanwhile are included by recalculating them afterwards, rather than by updating the rankings now
+            queryset.update(validated=True)
+            bump_data_versions([activity.id])
+            jobs = enqueue_recalculations_from(find_earliest_validated(queryset))
+            job_ids = ", ".join(str(job.id) for job in jobs)
+            self.message_user(request, f"GameSessions validated (recalculation queued as job {job_ids})")
+            return
+
         start = time.time()
         # Update player skills
         incremental_update_player_skills(queryset)
         # Validate sessions
         queryset.update(validated=True)
+        bump_data_versions([activity.id])
         end = time.time()
         self.message_user(request, f"GameSessions validated in {end - start:.2f}s")
 
     def invalidate_matches(self, request, queryset):
         """Define action to set a submission as invalid."""
+        # Skill rankings have to be recalculated if any of the sessions were already used to calculate them
+        earliest_changes = find_earliest_validated(queryset)
         queryset.update(validated=False)
+        bump_data_versions(queryset.values_list("activity_id", flat=True))
+        jobs = enqueue_recalculations_from(earliest_changes)
+        if len(jobs) > 0:
+            job_ids = ", ".join(str(job.id) for job in jobs)
+            self.message_user(request, f"GameSessions invalidated (recalculation queued as job {job_ids})")
+            return
         self.message_user(request, "GameSessions invalidated")
 
     def fix_incorrect_player(self, request, queryset):
@@ -146,21 +223,48 @@ class GameSessionAdmin(admin.ModelAdmin):
         return HttpResponseRedirect(reverse("select_fix_player", kwargs={"session_ids_str": result_ids}))
 
 
-class GameAdmin(admin.ModelAdmin):
+class RecalculationJobAdmin(admin.ModelAdmin):
+    """Admin view for RecalculationJobs."""
+
+    list_display = ("__str__", "games_processed", "games_total", "error")
+    list_filter = ("status", "activity")
+
+
+class GameAdmin(MatchDataAdmin):
     """Admin view for Games."""
 
     # Make it read-only so that it loads faster (no dropdown listing all GameSessions)
     readonly_fields = ("session",)
+    activity_lookup = "session__activity_id"
+
+
+class AdhocTeamAdmin(MatchDataAdmin):
+    """Admin view for AdhocTeams."""
+
+    activity_lookup = "session__activity_id"
+
+
+class ResultAdmin(MatchDataAdmin):
+    """Admin view for Results."""
+
+    activity_lookup = "game__session__activity_id"
+
+
+class TeamMemberAdmin(MatchDataAdmin):
+    """Admin view for TeamMembers."""
+
+    activity_lookup = "team__session__activity_id"
 
 
 # Register your models here.
 admin.site.register(Activity, ActivityAdmin)
-admin.site.register(AdhocTeam)
+admin.site.register(AdhocTeam, AdhocTeamAdmin)
 admin.site.register(Player, PlayerAdmin)
 admin.site.register(Ranking, RankingAdmin)
+admin.site.register(RecalculationJob, RecalculationJobAdmin)
 admin.site.register(GameSession, GameSessionAdmin)
 admin.site.register(Game, GameAdmin)
-admin.site.register(Result)
+admin.site.register(Result, ResultAdmin)
 admin.site.register(SkillHistory)
 admin.site.register(SkillType)
-admin.site.register(TeamMember)
+admin.site.register(TeamMember, TeamMemberAdmin)
@@ -2,13 +2,14 @@
 
 import datetime
 import json
-import socket
 import time
-from typing import Any, List, Optional
+from typing import List, Optional
 
-from django.db.models import ExpressionWrapper, F, FloatField, Value
+from django.db import transaction
+from django.db.models import ExpressionWrapper, F, FloatField, Prefetch, Value
 from django.db.models.functions import Greatest, Least
 from django.http import HttpRequest, HttpResponse
+from django.utils.decorators import method_decorator
 from django_filters import BooleanFilter, FilterSet, NumberFilter
 from drf_spectacular.utils import (
     OpenApiParameter,
@@ -23,25 +24,44 @@ from rest_framework.decorators import (
     authentication_classes,
     permission_classes,
 )
+from rest_framework.exceptions import NotFound
 from rest_framework.request import Request
 from rest_framework.response import Response
 
+from .cache import (
+    activity_from_query,
+    activity_id_from_path,
+    all_activities,
+    bump_data_versions,
+    cache_per_activity,
+)
+from .dashboard import PENDING_MATCHES, get_dashboard
+from .jobs import enqueue_recalculations_from, find_earliest_validated
 from .models import (
     Activity,
     AdhocTeam,
     Game,
     GameSession,
+    LeaderboardEntry,
     Player,
     Ranking,
     Result,
     SkillHistory,
     TeamMember,
+    annotate_winning_team,
+    calc_skill,
 )
+from .ratings import refresh_leaderboard
+from .registry import registry
+from .resolver import resolver, submittor_ip
+from .series import DOWNSAMPLERS, MIN_THRESHOLD
 from .utils import (
     CsrfExemptSessionAuthentication,
     FieldFilterMixin,
     FieldFilterModelSerializer,
+    KeysetPagination,
     ValidateParamsMixin,
+    ValuesListMixin,
 )
 
 # Query parameter to use for filtering fields returned by the serializer.
@@ -101,6 +121,7 @@ class ActivitySerializer(serializers.HyperlinkedModelSerializer, FieldFilterMode
         ),
     ]
 )
+@method_decorator(cache_per_activity(all_activities), name="dispatch")
 class ActivityViewSet(FieldFilterMixin, ValidateParamsMixin, viewsets.ModelViewSet):
     """API for handling all known activities."""
 
@@ -124,6 +145,7 @@ class PlayerSerializer(serializers.HyperlinkedModelSerializer, FieldFilterModelS
         ]
 
 
+@method_decorator(cache_per_activity(all_activities), name="dispatch")
 class PlayerViewSet(FieldFilterMixin, ValidateParamsMixin, viewsets.ModelViewSet):
     """API for handling all known players."""
 
@@ -141,6 +163,8 @@ class RankingSerializer(serializers.HyperlinkedModelSerializer, FieldFilterModel
     activity = ActivitySerializer(fields=["name"])
     player = PlayerSerializer(fields=["id", "name"])
     skill = serializers.ReadOnlyField()
+    position = serializers.IntegerField(read_only=True)
+    delta = serializers.FloatField(read_only=True)
 
     class Meta:
         model = Ranking
@@ -148,20 +172,62 @@ class RankingSerializer(serializers.HyperlinkedModelSerializer, FieldFilterModel
             "activity",
             "player",
             "skill",
+            "position",
+            "delta",
             "mu",
             "sigma",
         ]
 
 
-class RankingViewSet(FieldFilterMixin, ValidateParamsMixin, viewsets.ModelViewSet):
+@method_decorator(cache_per_activity(activity_from_query), name="dispatch")
+class RankingViewSet(ValuesListMixin, ValidateParamsMixin, viewsets.ModelViewSet):
     """API for handling rankings of players per activity."""
 
-    queryset = Ranking.objects.annotate(skill=SKILL_EXPRESSION).filter(player__active=True, skill__gt=0)
+    # Skill and position are read from the (precalculated) leaderboard
+    queryset = Ranking.objects.annotate(
+        skill=F("leaderboard__skill"), position=F("leaderboard__position"), delta=F("leaderboard__delta")
+    ).filter(player__active=True, skill__gt=0)
+    # Lists are read from the leaderboard itself, so that they're filtered and ordered by its (activity, skill) index
+    list_queryset = (
+        LeaderboardEntry.objects.select_related("ranking", "player")
+        .annotate(mu=F("ranking__mu"), sigma=F("ranking__sigma"))
+        .filter(player__active=True, skill__gt=0)
+    )
     serializer_class = RankingSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     filterset_fields = ["activity"]
     search_fields: List[str] = ["skill"]  # "activity.name", "player.name"]
     field_filter_param = FIELD_FILTER_PARAM
+    # Lists are built from the values of the fields of `RankingSerializer`
+    values_fields = {
+        "activity": {"name": "activity__name"},
+        "player": {"id": "player_id", "name": "player__name"},
+        "skill": "skill",
+        "position": "position",
+        "delta": "delta",
+        "mu": "mu",
+        "sigma": "sigma",
+    }
+
+    def get_queryset(self):
+        """Get the rankings, from the leaderboard when listing them."""
+        queryset = super().get_queryset()
+        return self.list_queryset.all() if self.action == "list" else queryset
+
+    def perform_create(self, serializer):
+        """Create a ranking and update the leaderboard of its activity."""
+        super().perform_create(serializer)
+        refresh_leaderboard(serializer.instance.activity_id)
+
+    def perform_update(self, serializer):
+        """Update a ranking and the leaderboard of its activity."""
+        super().perform_update(serializer)
+        refresh_leaderboard(serializer.instance.activity_id)
+
+    def perform_destroy(self, instance):
+        """Delete a ranking and update the leaderboard of its activity."""
+        super().perform_destroy(instance)
+        refresh_leaderboard(instance.activity_id)
 
 
 class SkillHistoryGameSerializer(serializers.HyperlinkedModelSerializer, FieldFilterModelSerializer):
@@ -217,26 +283,121 @@ class SkillHistorySerializer(serializers.HyperlinkedModelSerializer, FieldFilter
         ]
 
 
-class SkillHistoryViewSet(FieldFilterMixin, ValidateParamsMixin, viewsets.ModelViewSet):
+@method_decorator(cache_per_activity(activity_id_from_path), name="dispatch")
+class SkillHistoryViewSet(ValuesListMixin, ValidateParamsMixin, viewsets.ModelViewSet):
     """API for handling the historical record of a player's skill over time (per activity)."""
 
     queryset = SkillHistory.objects.annotate(skill=SKILL_EXPRESSION).filter(player__active=True)
     serializer_class = SkillHistorySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = KeysetPagination
     filterset_fields = ["activity_id", "player"]
     search_fields: List[str] = []
     field_filter_param = FIELD_FILTER_PARAM
+    # Lists are built from the values of the fields of `SkillHistorySerializer`
+    values_fields = {
+        "activity_id": "activity_id",
+        "datetime": "datetime",
+        "match_id": "match_id",
+        "player": {"id": "player_id", "name": "player__name"},
+        "result": {
+            "game": {
+                "id": "result__game_id",
+                "datetime": "result__game__datetime",
+                "submittor": "result__game__submittor",
+            }
+        },
+        "skill": "skill",
+        "mu": "mu",
+        "sigma": "sigma",
+    }
 
     def get_queryset(self):
         """Get the list of items for this view."""
         base_query = super().get_queryset()
-        activity_url = self.kwargs["activity_url"]
+        activity_id = registry.resolve_id(self.kwargs["activity_url"])
         player_id = self.kwargs["player_id"]
-        return base_query.filter(activity_id=activity_url, player__id=player_id).annotate(
+        return base_query.filter(activity_id=activity_id, player__id=player_id).annotate(
             datetime=F("result__game__datetime"), match_id=F("result__game__session__id")
         )
 
 
+class SkillSeriesParamsSerializer(serializers.Serializer):
+    """Query parameters of a (downsampled) skill history series."""
+
+    width = serializers.IntegerField(
+        default=500, min_value=MIN_THRESHOLD, max_value=10000, help_text="Maximum number of points to return."
+    )
+    start = serializers.IntegerField(required=False, help_text="Only include matches from this time (UNIX timestamp).")
+    end = serializers.IntegerField(required=False, help_text="Only include matches up to this time (UNIX timestamp).")
+    method = serializers.ChoiceField(
+        choices=list(DOWNSAMPLERS),
+        default="lttb",
+        help_text='Downsampling method: "lttb" (keeps the shape) or "minmax" (keeps the extremes).',
+    )
+
+
+class SkillSeriesPointSerializer(serializers.Serializer):
+    """A point in a skill history series."""
+
+    index = serializers.IntegerField(help_text="Number of matches played before this one (within the time range).")
+    datetime = serializers.IntegerField()
+    match_id = serializers.IntegerField()
+    skill = serializers.FloatField()
+    mu = serializers.FloatField()
+    sigma = serializers.FloatField()
+
+
+@extend_schema(
+    parameters=[SkillSeriesParamsSerializer],
+    responses=inline_serializer(
+        "SkillSeries",
+        fields={
+            "total": serializers.IntegerField(),
+            "points": SkillSeriesPointSerializer(many=True),
+        },
+    ),
+)
+@cache_per_activity(activity_id_from_path)
+@api_view()
+def skill_series(request: Request, activity_url: str, player_id: int) -> Response:
+    """
+    Get a player's skill history, downsampled to at most `width` points (e.g. the width of a chart in pixels).
+
+    The full history (within the time range) is read in a single query.
+    """
+    params_serializer = SkillSeriesParamsSerializer(data=request.query_params)
+    params_serializer.is_valid(raise_exception=True)
+    params = params_serializer.validated_data
+
+    activity_id = registry.resolve_id(activity_url)
+    history = SkillHistory.objects.filter(activity_id=activity_id, player_id=player_id, player__active=True)
+    if "start" in params:
+        history = history.filter(result__game__datetime__gte=params["start"])
+    if "end" in params:
+        history = history.filter(result__game__datetime__lte=params["end"])
+    rows = list(
+        history.order_by("result__game__datetime", "id").values_list(
+            "result__game__datetime", "result__game__session_id", "mu", "sigma"
+        )
+    )
+
+    skills = [calc_skill(mu, sigma) for _, _, mu, sigma in rows]
+    selected = DOWNSAMPLERS[params["method"]](range(len(rows)), skills, params["width"])
+    points = [
+        {
+            "index": idx,
+            "datetime": rows[idx][0],
+            "match_id": rows[idx][1],
+            "skill": skills[idx],
+            "mu": rows[idx][2],
+            "sigma": rows[idx][3],
+        }
+        for idx in selected
+    ]
+    return Response({"total": len(rows), "points": points})
+
+
 class TeamMemberSerializer(serializers.HyperlinkedModelSerializer, FieldFilterModelSerializer):
     """Serializer for TeamMember."""
 
@@ -276,8 +437,10 @@ class MatchGameSerializer(serializers.HyperlinkedModelSerializer, FieldFilterMod
         ]
 
     def find_winning_team(self, game) -> int:
-        """Fetch ID of team with rank of 1 in the current game."""
-        return Result.objects.filter(game=game, ranking=1).first().team.id
+        """Fetch ID of team with rank of 1 in the current game (unless it was annotated by `annotate_winning_team`)."""
+        if hasattr(game, "winning_team_id"):
+            return game.winning_team_id
+        return Result.objects.filter(game=game, ranking=1).first().team_id
 
 
 class MatchSerializer(serializers.HyperlinkedModelSerializer, FieldFilterModelSerializer):
@@ -305,22 +468,100 @@ class MatchFilter(FilterSet):
     pending = BooleanFilter(field_name="validated", lookup_expr="isnull")
 
 
+@method_decorator(cache_per_activity(activity_id_from_path), name="dispatch")
 class MatchViewSet(FieldFilterMixin, ValidateParamsMixin, viewsets.ModelViewSet):
     """API for handling matches (potentially a set of multiple games) per activity."""
 
     queryset = GameSession.objects.all()
     serializer_class = MatchSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = KeysetPagination
     filterset_class = MatchFilter
     filterset_fields = ["validated", "pending"]
     search_fields: List[str] = ["submittor"]
     field_filter_param = FIELD_FILTER_PARAM
 
     def get_queryset(self):
-        """Get the list of items for this view."""
+        """Get the list of items for this view.
+
+        The games and teams of all the matches are prefetched (only if they're selected), so that a fixed number of
+        queries is used regardless of the number of matches.
+        """
         base_query = super().get_queryset()
-        activity_url = self.kwargs["activity_url"]
-        return base_query.filter(activity_id=activity_url)
+        activity_id = registry.resolve_id(self.kwargs["activity_url"])
+        fields = self.get_selected_fields() or MatchSerializer.Meta.fields
+        if "games" in fields:
+            base_query = base_query.prefetch_related(
+                Prefetch("game_set", queryset=annotate_winning_team(Game.objects.all()))
+            )
+        if "teams" in fields:
+            members = Prefetch("teammember_set", queryset=TeamMember.objects.select_related("player"))
+            base_query = base_query.prefetch_related(
+                Prefetch("adhocteam_set", queryset=AdhocTeam.objects.prefetch_related(members))
+            )
+        return base_query.filter(activity_id=activity_id)
+
+    def perform_create(self, serializer):
+        """Create a match and expire the cached responses of its activity."""
+        super().perform_create(serializer)
+        bump_data_versions([registry.resolve_id(self.kwargs["activity_url"])])
+
+    def perform_update(self, serializer):
+        """Update a match and expire the cached responses of its activity."""
+        super().perform_update(serializer)
+        bump_data_versions([registry.resolve_id(self.kwargs["activity_url"])])
+
+    def perform_destroy(self, instance):
+        """Delete a match and expire the cached responses of its activity."""
+        super().perform_destroy(instance)
+        bump_data_versions([registry.resolve_id(self.kwargs["activity_url"])])
+
+
+class LeaderboardPlayerSerializer(serializers.Serializer):
+    """A player on the leaderboard of an activity."""
+
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    skill = serializers.FloatField()
+    position = serializers.IntegerField()
+    delta = serializers.FloatField(allow_null=True)
+
+
+@extend_schema(
+    responses=inline_serializer(
+        "Dashboard",
+        fields={
+            "activity": ActivitySerializer(fields=["id", "url", "name"]),
+            "top_players": LeaderboardPlayerSerializer(many=True),
+            "recent_matches": MatchSerializer(many=True),
+            "pending_matches": MatchSerializer(many=True),
+            "players": PlayerSerializer(fields=["id", "name"], many=True),
+        },
+    ),
+)
+@cache_per_activity()
+@api_view()
+def dashboard(request: Request, activity_url: str) -> Response:
+    """
+    Get everything shown on the summary page of an activity.
+
+    Includes the top players, the most recent validated and pending matches (in the same format as `/api/matches`, with
+    at most a page of 100 pending matches) and all active players (that can be chosen when submitting a match). A fixed
+    number of queries is used.
+    """
+    activity = registry.get_by_url(activity_url)
+    if activity is None:
+        raise NotFound(f"Unknown activity: {activity_url}")
+    data = get_dashboard(activity, pending_matches=PENDING_MATCHES)
+    return Response(
+        {
+            "activity": {"id": activity.id, "url": activity.url, "name": activity.name},
+            "top_players": [entry.to_dict_with_player() for entry in data.top_players],
+            "recent_matches": MatchSerializer(data.recent_matches, many=True).data,
+            "pending_matches": MatchSerializer(data.pending_matches, many=True).data,
+            "players": [{"id": player_id, "name": name} for player_id, name in data.players],
+        }
+    )
 
 
 @extend_schema(request=None, responses=None, auth=[])
@@ -352,7 +593,7 @@ def undo_submit(request: Request, activity_url: str) -> Response:
     """
     submittor = identify_request_source(request)
 
-    activity = Activity.objects.get(url=activity_url)
+    activity = registry.get_by_url(activity_url)
     if activity is None:
         return gen_valid_reason_response(valid=False, reason="Activity not found")
 
@@ -366,7 +607,8 @@ def undo_submit(request: Request, activity_url: str) -> Response:
     except Game.DoesNotExist:
         return gen_valid_reason_response(valid=False, reason=f"Match not found: {game_id}")
 
-    if game.session.submittor != submittor:
+    # Hostnames might have been added (or expired) since the submission was made
+    if submittor_ip(game.session.submittor) != submittor_ip(submittor):
         return gen_valid_reason_response(valid=False, reason="Only the original submittor can delete their submission")
 
     # TODO: use UTC?
@@ -377,6 +619,7 @@ def undo_submit(request: Request, activity_url: str) -> Response:
         )
 
     game.delete()
+    bump_data_versions([activity.id])
 
     return gen_valid_reason_response(valid=True, reason=f"Match {game_id} deleted")
 
@@ -417,7 +660,7 @@ def submit_match(request: Request, activity_url: str) -> Response:
     """
     submittor = identify_request_source(request)
 
-    activity = Activity.objects.get(url=activity_url)
+    activity = registry.get_by_url(activity_url)
     if activity is None:
         return gen_valid_reason_response(valid=False, reason="Activity not found")
 
@@ -448,6 +691,8 @@ def submit_match(request: Request, activity_url: str) -> Response:
     # help locate any issues in the form
     if result_ids is None:
         return gen_valid_reason_response(valid=False, reason="Submission failed")
+    # Only look up the hostname once the matches are recorded, so that it can be back-filled into them
+    resolver.resolve_after_commit(submittor, result_ids)
     return gen_valid_reason_response(valid=True, reason="")
 
 
@@ -479,6 +724,9 @@ def replace_player_in_submissions(request: Request) -> Response:
     count_changed = team_members.filter(player=Player.objects.get(id=prev_player_id)).update(
         player=Player.objects.get(id=new_player_id)
     )
+    # Skill rankings have to be recalculated if any of the changed sessions were already used to calculate them
+    enqueue_recalculations_from(find_earliest_validated(GameSession.objects.filter(id__in=session_ids)))
+    bump_data_versions(GameSession.objects.filter(id__in=session_ids).values_list("activity_id", flat=True))
     return HttpResponse(
         f"Successfully changed {count_changed} submissions",
         content_type="text/plain",
@@ -493,69 +741,59 @@ def record_matches(
     submittor: str,
     submission_time: Optional[int] = None,
 ) -> Optional[List[int]]:
-    """Record multiple matches for a single activity."""
+    """Record multiple matches for a single activity.
+
+    All matches are inserted in bulk within a single transaction, so that either all or none of them are recorded.
+    Returns the ids of the new sessions, or None if any team is empty or contains an unknown player.
+    """
     if len(teams_per_match) != len(winning_team_per_match):
         raise ValueError("Per-match lists should have the same length")
-    results = []
-
-    for i in range(len(teams_per_match)):
-        if submission_time is None:
-            submission_time = int(time.time())
-        session = GameSession(activity=activity, datetime=submission_time, submittor=submittor)
-        session.save()
-
-        winning_team = winning_team_per_match[i]
-        team = teams_per_match[i]
-        result_id = record_match(session, team, int(winning_team))
-        if result_id is None:
-            # TODO: invalidate/rollback whole list of matches!
-            return None
-        results.append(result_id)
-    return results
-
-
-def record_match(session: GameSession, teams: List[List[int]], winning_team: int) -> Optional[Any]:
-    """Record a single match as part of the given GameSession."""
-    # TODO: support any number of teams (2+)
-    if winning_team == 1:
-        rankings = [1, 2]
-    elif winning_team == 2:  # noqa: PLR2004
-        rankings = [2, 1]
-    else:
-        raise AssertionError(f"Winner incorrectly identified: {winning_team}")
+    rankings_per_match = [match_rankings(int(winning_team)) for winning_team in winning_team_per_match]
 
+    player_ids = {player_id for teams in teams_per_match for team in teams for player_id in team}
+    # TODO: support any number of teams (2+)
+    if any(len(teams) != len(rankings) for teams, rankings in zip(teams_per_match, rankings_per_match)):
+        return None
+    if any(len(team) == 0 for teams in teams_per_match for team in teams):
+        return None
+    if Player.objects.filter(id__in=player_ids).count() != len(player_ids):
+        return None
+
+    if submission_time is None:
+        submission_time = int(time.time())
     submit_time = int(time.time())
-    game = Game.objects.create(datetime=submit_time, submittor=session.submittor, session=session, position=0)
-
-    for i, team in enumerate(teams):
-        if len(team) == 0:
-            session.validated = False
-            session.save()
-            return None
-
-        adhoc_team = AdhocTeam(session=session)
-        adhoc_team.save()
-
-        _ = Result.objects.create(
-            datetime=submit_time,
-            submittor=session.submittor,
-            game=game,
-            team=adhoc_team,
-            ranking=rankings[i],
+    with transaction.atomic():
+        sessions = GameSession.objects.bulk_create(
+            GameSession(activity=activity, datetime=submission_time, submittor=submittor) for _ in teams_per_match
         )
+        games = Game.objects.bulk_create(
+            Game(datetime=submit_time, submittor=submittor, session=session, position=0) for session in sessions
+        )
+        adhoc_teams = AdhocTeam.objects.bulk_create(
+            AdhocTeam(session=session) for session, teams in zip(sessions, teams_per_match) for _ in teams
+        )
+        results: List[Result] = []
+        members: List[TeamMember] = []
+        match_teams = iter(adhoc_teams)
+        for game, teams, rankings in zip(games, teams_per_match, rankings_per_match):
+            for team, ranking, adhoc_team in zip(teams, rankings, match_teams):
+                results.append(
+                    Result(datetime=submit_time, submittor=submittor, game=game, team=adhoc_team, ranking=ranking)
+                )
+                members.extend(TeamMember(team=adhoc_team, player_id=player_id) for player_id in team)
+        Result.objects.bulk_create(results)
+        TeamMember.objects.bulk_create(members)
+        bump_data_versions([activity.id])
+    return [session.id for session in sessions]
 
-        for player_id in team:
-            # exit on invalid player
-            if player_id < 0:
-                session.validated = False
-                session.save()
-                return None
-            player = Player.objects.get(id=player_id)
-
-            member = TeamMember(team=adhoc_team, player=player)
-            member.save()
 
-    return session.id
+def match_rankings(winning_team: int) -> List[int]:
+    """Determine the ranking of each team in a (two-team) match given which team won (1-indexed)."""
+    if winning_team == 1:
+        return [1, 2]
+    if winning_team == 2:  # noqa: PLR2004
+        return [2, 1]
+    raise AssertionError(f"Winner incorrectly identified: {winning_team}")
 
 
 @extend_schema(
@@ -575,20 +813,14 @@ def show_source_id(request: Request) -> Response:
 
 
 def identify_request_source(request: HttpRequest) -> str:
-    """Generate a string that identifies the source of the request."""
+    """Generate a string that identifies the source of the request.
+
+    This is the IP address of the request, which includes its hostname if that is already known (see `resolver`).
+    """
     src = str(request.META["REMOTE_ADDR"])
     # Detect nginx ip forwarding
     if "HTTP_X_REAL_IP" in request.META:
         src = str(request.META["HTTP_X_REAL_IP"])
     elif "HTTP_X_FORWARDED_FOR" in request.META:
         src = str(request.META["HTTP_X_FORWARDED_FOR"])
-    try:
-        # getfqdn() won't throw exception, but then we can't differentiate when it
-        # works, and we might generate e.g. "127.0.0.1 (127.0.0.1)"
-        # addr = socket.getfqdn(submittor)
-        addr = socket.gethostbyaddr(src)
-        src = f"{src} ({addr[0]})"
-    except:  # noqa: E722,S110
-        pass
-
-    return src
+    return resolver.describe(src)
@@ -1,9 +1,27 @@
 """Django app configuration."""
 
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+
+from .database import configure_connection
 
 
 class PreviousConfig(AppConfig):
     """Configuration for this app."""
 
     name = "previous"
+
+    def ready(self) -> None:
+        """Tune new database connections and expire cached responses (and activities) when they change."""
+        # Models can only be imported once the app is ready
+        from .cache import bump_all_data_versions
+        from .models import Activity, Player
+        from .registry import registry
+
+        connection_created.connect(configure_connection, dispatch_uid="previous.database.configure_connection")
+        for model in (Activity, Player):
+            for signal in (post_save, post_delete):
+                signal.connect(bump_all_data_versions, sender=model, dispatch_uid=f"previous.cache.{model.__name__}")
+        for signal in (post_save, post_delete):
+            signal.connect(registry.invalidate, sender=Activity, dispatch_uid="previous.registry")
@@ -0,0 +1 @@
+"""Database backend of the site (SQLite with configurable transaction modes, see `base`)."""
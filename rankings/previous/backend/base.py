@@ -0,0 +1,41 @@
+"""SQLite database backend that can start transactions in IMMEDIATE (or EXCLUSIVE) mode.
+
+Django 4.2 starts transactions with a (deferred) "BEGIN", which only takes the write lock once the transaction first
+writes. If another connection has written since the transaction started reading, taking the lock fails straight away
+with "database is locked" (the busy timeout doesn't apply). "BEGIN IMMEDIATE" takes the write lock at the start of the
+transaction instead, waiting for other writers for up to the busy timeout (see `settings.SQLITE_PRAGMAS`).
+
+The mode is set with the "transaction_mode" option of the database (like in Django 5.1), and plain "BEGIN" is used
+if it isn't set.
+"""
+
+from typing import Any, Dict, Optional
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ("DEFERRED", "IMMEDIATE", "EXCLUSIVE")
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """SQLite database connection that starts transactions in the configured mode."""
+
+    transaction_mode: Optional[str] = None
+
+    def get_connection_params(self) -> Dict[str, Any]:
+        """Get the parameters of new connections (without the transaction mode, which isn't one)."""
+        params: Dict[str, Any] = super().get_connection_params()
+        transaction_mode = params.pop("transaction_mode", None)
+        if transaction_mode is not None and transaction_mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f"Invalid SQLite transaction_mode: {transaction_mode!r} (use one of: {', '.join(TRANSACTION_MODES)})"
+            )
+        self.transaction_mode = transaction_mode and transaction_mode.upper()
+        return params
+
+    def _start_transaction_under_autocommit(self) -> None:
+        """Start a transaction (in autocommit mode, see Django's SQLite backend) in the configured mode."""
+        if self.transaction_mode is None:
+            super()._start_transaction_under_autocommit()
+            return
+        self.cursor().execute(f"BEGIN {self.transaction_mode}")
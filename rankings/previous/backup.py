@@ -0,0 +1,91 @@
+"""Online backups of the (SQLite) database.
+
+Backups are made with `VACUUM INTO`, which reads the database in a single read transaction. The copy is always
+consistent (unlike copying the file while it's being written to), and with WAL journal mode it doesn't block others
+(or get restarted) when they write in the meantime. The copy is written to a temporary file first, which is only
+renamed (or compressed) to the name of the backup once it's complete and verified.
+"""
+
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timezone
+from typing import List
+
+# Size of the chunks in which backups are compressed (in bytes)
+COMPRESS_CHUNK_SIZE = 1024 * 1024
+# Format of the UTC timestamp added to the names of backups, and a pattern that matches it
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H-%M-%S.%fZ"
+TIMESTAMP_PATTERN = r"\d{4}-\d{2}-\d{2}T\d{2}-\d{2}-\d{2}\.\d{6}Z"
+# Suffix of files that are still being written
+TEMPORARY_SUFFIX = ".tmp"
+
+
+def copy_database(source: str, destination: str) -> None:
+    """Copy (and compact) an SQLite database into a new file, in a single read transaction."""
+    with closing(sqlite3.connect(source)) as src:
+        src.execute("VACUUM INTO ?", (destination,))
+
+
+def check_integrity(path: str) -> List[str]:
+    """Check the integrity of an SQLite database and return any problems found."""
+    with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as conn:
+        problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    return [] if problems == ["ok"] else problems
+
+
+def compress_file(path: str, compressed: str) -> None:
+    """Compress a file into another one (in chunks, without reading it into memory) with gzip."""
+    with open(path, "rb") as src, gzip.open(compressed, "wb") as dst:
+        shutil.copyfileobj(src, dst, COMPRESS_CHUNK_SIZE)
+
+
+def backup_name_pattern(source: str) -> str:
+    """Get a pattern that matches the names of the backups of a database (see `backup_database`)."""
+    return re.escape(os.path.basename(source)) + r"\." + TIMESTAMP_PATTERN + r"(\.gz)?"
+
+
+def rotate_backups(folder: str, source: str, keep: int) -> List[str]:
+    """Remove all but the `keep` most recent backups of a database and return the removed files.
+
+    Only backups made by `backup_database` are considered (their names end with a timestamp), so that other files
+    (e.g. copies of the database made in other ways) are never removed.
+    """
+    pattern = re.compile(backup_name_pattern(source))
+    backups = [entry.path for entry in os.scandir(folder) if entry.is_file() and pattern.fullmatch(entry.name)]
+    # Timestamps are sorted by their names
+    backups.sort(reverse=True)
+    removed = backups[keep:]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def backup_database(source: str, folder: str, compress: bool = False, verify: bool = True) -> str:  # noqa: FBT001,FBT002
+    """Back up a database to a new file (with a UTC timestamp in its name) in a folder and return its path.
+
+    The backup is verified (before being compressed), and not kept if it's corrupt.
+    """
+    timestamp = datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT)
+    path = os.path.join(folder, f"{os.path.basename(source)}.{timestamp}")
+    copy = path + TEMPORARY_SUFFIX
+    try:
+        copy_database(source, copy)
+        if verify:
+            problems = check_integrity(copy)
+            if problems:
+                raise ValueError("Backup failed the integrity check:\n" + "\n".join(problems))
+        if not compress:
+            os.replace(copy, path)
+            return path
+        compressed = f"{path}.gz"
+        compress_file(copy, compressed + TEMPORARY_SUFFIX)
+        os.replace(compressed + TEMPORARY_SUFFIX, compressed)
+        return compressed
+    finally:
+        for temporary in (copy, f"{path}.gz{TEMPORARY_SUFFIX}"):
+            if os.path.exists(temporary):
+                os.remove(temporary)
@@ -0,0 +1,505 @@
+"""Benchmarks of the number of queries, response time and peak memory usage of every endpoint.
+
+A synthetic database is generated (with matches of the same shape as those recorded by `api.record_matches`) and a
+request is made to each endpoint. Each endpoint has a budget for the number of queries it may use, so that N+1 query
+patterns are caught by the tests (which use a small database) and by the `benchmark` command (which uses a large one).
+"""
+
+import json
+import random
+import time
+import tracemalloc
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q, QuerySet
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from .api import RankingViewSet, SkillHistoryViewSet
+from .dashboard import get_leaderboard
+from .export import EXPORTS
+from .jobs import enqueue_recalculation, process_queued_jobs
+from .models import (
+    Activity,
+    AdhocTeam,
+    Game,
+    GameSession,
+    LeaderboardEntry,
+    Player,
+    RatingCheckpoint,
+    RecalculationJob,
+    Result,
+    SkillHistory,
+    TeamMember,
+)
+from .ratings import BULK_BATCH_SIZE, batched
+from .registry import registry
+from .renderers import FastJSONRenderer
+from .urls import SSR_PREFIX
+from .utils import KeysetPagination
+
+# Maximum number of queries per endpoint (regardless of the amount of data) when the response isn't cached. Some
+# endpoints still use a few queries per item listed, in which case the budget is for a full page of items.
+QUERY_BUDGETS = {
+    "api-id": 0,
+    "api-root": 0,
+    "api-activities": 3,
+    "api-activity": 2,
+    "api-players": 3,
+    "api-player": 2,
+    "api-rankings": 4,
+    "api-ranking": 4,
+    "api-skill-history": 2,
+    "api-skill-history-entry": 5,
+    "api-skill-series": 2,
+    "api-matches": 5,
+    "api-match": 5,
+    "api-dashboard": 8,
+    "api-export-matches": 1,
+    "api-export-skill-history": 1,
+    "api-validate-all": 2,
+    "api-fix-player": 10,
+    "api-add-matches": 10,
+    "api-undo-submission": 2,
+    "ssr-home": 1,
+    "ssr-about": 1,
+    "ssr-activity-summary": 8,
+    "ssr-players-by-skill": 5,
+    "ssr-players-by-name": 4,
+    "ssr-player": 3,
+    "ssr-player-history": 2,
+    "ssr-matches": 11,
+    "ssr-matches-page": 11,
+    "ssr-match-list": 11,
+    "ssr-match": 11,
+    "admin-select-player-to-fix": 21,
+    "admin-job-status": 3,
+    "admin-update": 3,
+    "admin-update-year": 3,
+}
+
+# Main queries (see `get_main_queries`) that sort their rows without an index, and why that's fine
+UNINDEXED_QUERIES = {
+    "session-games": "the rating engine sorts the games of each chunk of sessions that it replays once, when loading",
+    "skill-history": "a single player's history is sorted by the datetime of its games (which is in another table)",
+}
+
+# Routes that aren't benchmarked since they don't access the database (or only serve documentation).
+EXCLUDED_ROUTES = ("api/openapi.json", "api/docs", "admin/")
+
+
+class SyntheticData(NamedTuple):
+    """Ids of (a sample of) the objects generated by `generate_data`."""
+
+    activity_id: str
+    player_ids: List[int]
+    validated_session_ids: List[int]
+    pending_game_ids: List[int]
+
+
+class Endpoint(NamedTuple):
+    """A request to make to an endpoint."""
+
+    name: str
+    path: str
+    method: str = "GET"
+    data: Optional[Dict[str, Any]] = None
+    # Send data as JSON (instead of as a form)
+    json: bool = False
+    # Make the request as a superuser
+    admin: bool = False
+
+
+class Measurement(NamedTuple):
+    """The resources used to respond to a request to an endpoint."""
+
+    name: str
+    status: int
+    queries: int
+    seconds: float
+    peak_memory: int
+
+
+class SerializationMeasurement(NamedTuple):
+    """The time used to list items with serializers and `JSONRenderer` (before) or with values and `FastJSONRenderer`.
+
+    Times are in seconds per 1000 items.
+    """
+
+    name: str
+    items: int
+    serialize_before: float
+    serialize_after: float
+    render_before: float
+    render_after: float
+
+
+def generate_data(
+    players: int, games: int, activity_id: str = "benchmark", pending: int = 50, seed: int = 0
+) -> SyntheticData:
+    """Generate an activity with the given number of players and (single-game, one vs. one) matches.
+
+    All matches are validated except for the last `pending` ones, and skill rankings are calculated.
+    """
+    rand = random.Random(seed)  # noqa: S311
+    activity = Activity.objects.create(id=activity_id, url=activity_id, name=activity_id)
+    new_players = Player.objects.bulk_create(
+        (Player(name=f"Player {idx}", email=f"player{idx}@example.com") for idx in range(players)),
+        batch_size=BULK_BATCH_SIZE,
+    )
+    player_ids = [player.id for player in new_players]
+
+    start_time = int(time.time()) - games * 60
+    for batch in batched(range(games), BULK_BATCH_SIZE):
+        submittor = "benchmark.setup"
+        sessions = GameSession.objects.bulk_create(
+            GameSession(
+                activity=activity,
+                validated=None if idx >= games - pending else 1,
+                datetime=start_time + idx * 60,
+                submittor=submittor,
+            )
+            for idx in batch
+        )
+        new_games = Game.objects.bulk_create(
+            Game(session=session, position=0, datetime=session.datetime, submittor=submittor) for session in sessions
+        )
+        teams = AdhocTeam.objects.bulk_create(AdhocTeam(session=session) for session in sessions for _ in range(2))
+        members = []
+        results = []
+        for game_idx, game in enumerate(new_games):
+            winner, loser = rand.sample(player_ids, 2)
+            for ranking, (team, player_id) in enumerate(zip(teams[2 * game_idx :], [winner, loser]), start=1):
+                members.append(TeamMember(team=team, player_id=player_id, validated=None))
+                results.append(Result(game=game, team=team, ranking=ranking))
+        TeamMember.objects.bulk_create(members)
+        Result.objects.bulk_create(results)
+
+    enqueue_recalculation(activity)
+    process_queued_jobs()
+
+    sessions = GameSession.objects.filter(activity=activity).order_by("id")
+    pending_games = Game.objects.filter(session__in=sessions.filter(validated=None)).order_by("id")
+    return SyntheticData(
+        activity_id=activity_id,
+        player_ids=player_ids,
+        validated_session_ids=list(sessions.filter(validated=1).values_list("id", flat=True)[:2]),
+        pending_game_ids=list(pending_games.values_list("id", flat=True)),
+    )
+
+
+def get_endpoints(data: SyntheticData) -> List[Endpoint]:
+    """List a request to make to each endpoint (see `previous.urls`) for the given data."""
+    act = data.activity_id
+    leader = LeaderboardEntry.objects.filter(activity_id=act, position=1).get()
+    history = SkillHistory.objects.filter(activity_id=act, player_id=leader.player_id).order_by("id").first()
+    session_id = data.validated_session_ids[0]
+    game_id = Game.objects.filter(session_id=session_id).values_list("id", flat=True).get()
+    job = RecalculationJob.objects.filter(activity_id=act).order_by("id").first()
+    session_ids = ",".join(str(session_id) for session_id in data.validated_session_ids)
+    return [
+        Endpoint("api-id", "/api/id"),
+        Endpoint("api-root", "/api/"),
+        Endpoint("api-activities", "/api/activities/"),
+        Endpoint("api-activity", f"/api/activities/{act}/"),
+        Endpoint("api-players", "/api/players/"),
+        Endpoint("api-player", f"/api/players/{leader.player_id}/"),
+        Endpoint("api-rankings", f"/api/rankings/?activity={act}&ordering=-skill"),
+        Endpoint("api-ranking", f"/api/rankings/{leader.ranking_id}/"),
+        Endpoint("api-skill-history", f"/api/skill-history/{act}/{leader.player_id}/"),
+        Endpoint("api-skill-history-entry", f"/api/skill-history/{act}/{leader.player_id}/{history.id}/"),
+        Endpoint("api-skill-series", f"/api/skill-series/{act}/{leader.player_id}/?width=100"),
+        Endpoint("api-matches", f"/api/matches/{act}/"),
+        Endpoint("api-match", f"/api/matches/{act}/{session_id}/"),
+        Endpoint("api-dashboard", f"/api/dashboard/{act}/"),
+        Endpoint("api-export-matches", f"/api/export/{act}/matches.ndjson"),
+        Endpoint("api-export-skill-history", f"/api/export/{act}/skill-history.csv"),
+        Endpoint("api-validate-all", "/api/validate_all", admin=True),
+        Endpoint(
+            "api-fix-player",
+            "/api/fix_player",
+            method="POST",
+            data={"session_ids": session_ids, "prev_player_id": leader.player_id, "new_player_id": leader.player_id},
+            admin=True,
+        ),
+        Endpoint(
+            "api-add-matches",
+            f"/{act}/api/add_matches",
+            method="POST",
+            data={"teams": [[[data.player_ids[0]], [data.player_ids[1]]]], "wins": [1]},
+            json=True,
+        ),
+        Endpoint(
+            "api-undo-submission",
+            f"/{act}/api/undo_submission",
+            method="POST",
+            data={"match-id": data.pending_game_ids[-1]},
+            json=True,
+        ),
+        Endpoint("ssr-home", f"/{SSR_PREFIX}"),
+        Endpoint("ssr-about", f"/{SSR_PREFIX}about"),
+        Endpoint("ssr-activity-summary", f"/{SSR_PREFIX}{act}/"),
+        Endpoint("ssr-players-by-skill", f"/{SSR_PREFIX}{act}/players/skill"),
+        Endpoint("ssr-players-by-name", f"/{SSR_PREFIX}{act}/players/name"),
+        Endpoint("ssr-player", f"/{SSR_PREFIX}{act}/player/{leader.player_id}"),
+        Endpoint("ssr-player-history", f"/{SSR_PREFIX}{act}/player/{leader.player_id}/history"),
+        Endpoint("ssr-matches", f"/{SSR_PREFIX}{act}/matches"),
+        Endpoint("ssr-matches-page", f"/{SSR_PREFIX}{act}/matches/2"),
+        Endpoint("ssr-match-list", f"/{SSR_PREFIX}{act}/match/"),
+        Endpoint("ssr-match", f"/{SSR_PREFIX}{act}/match/{game_id}"),
+        Endpoint("admin-select-player-to-fix", f"/admin_api/select_player_to_fix/{session_ids}", admin=True),
+        Endpoint("admin-job-status", f"/admin_api/jobs/{job.id}", admin=True),
+        Endpoint("admin-update", f"/admin_api/{act}/update", admin=True),
+        Endpoint("admin-update-year", f"/admin_api/{act}/update/2020", admin=True),
+    ]
+
+
+def list_routes(patterns: Optional[Iterable[Any]] = None, prefix: str = "") -> List[str]:
+    """List the (regex) routes of all URL patterns, excluding variants with format suffixes."""
+    if patterns is None:
+        patterns = get_resolver().url_patterns
+    routes = []
+    for pattern in patterns:
+        # Routes are joined in the same way as `ResolverMatch.route`
+        route = str(pattern.pattern)
+        if prefix:
+            route = prefix + route.removeprefix("^")
+        if isinstance(pattern, URLResolver):
+            routes.extend(list_routes(pattern.url_patterns, route))
+        elif isinstance(pattern, URLPattern) and "format" not in pattern.pattern.regex.groupindex:
+            routes.append(route)
+    return routes
+
+
+def find_unbenchmarked_routes(endpoints: Iterable[Endpoint]) -> List[str]:
+    """Find routes without any endpoint requests to benchmark them."""
+    resolver = get_resolver()
+    benchmarked = {resolver.resolve(endpoint.path.split("?")[0]).route for endpoint in endpoints}
+    return [
+        route
+        for route in list_routes()
+        if route not in benchmarked and not route.lstrip("^").startswith(EXCLUDED_ROUTES)
+    ]
+
+
+def request(client: Client, endpoint: Endpoint) -> int:
+    """Make the request to an endpoint and return the response's status code."""
+    if endpoint.method == "POST" and endpoint.json:
+        response = client.post(endpoint.path, json.dumps(endpoint.data), content_type="application/json")
+    elif endpoint.method == "POST":
+        response = client.post(endpoint.path, endpoint.data)
+    else:
+        response = client.get(endpoint.path)
+    if response.streaming:
+        # Streamed responses are only generated as they're read
+        for _ in response.streaming_content:
+            pass
+    return int(response.status_code)
+
+
+def measure(client: Client, endpoint: Endpoint) -> Measurement:
+    """Measure the resources used to respond to a request (changes made to the database are rolled back).
+
+    Cached responses are cleared first, so that the response is always generated. Activities are loaded (by the
+    registry) beforehand, since a process only loads them once rather than per request.
+    """
+    cache.clear()
+    registry.all()
+    with transaction.atomic():
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            status = request(client, endpoint)
+            seconds = time.perf_counter() - start
+        # The log of queries is cleared by later requests
+        query_count = len(queries)
+        transaction.set_rollback(True)
+
+    # Memory is measured separately since tracing slows down the request
+    cache.clear()
+    registry.all()
+    with transaction.atomic():
+        tracemalloc.start()
+        try:
+            request(client, endpoint)
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        transaction.set_rollback(True)
+    return Measurement(endpoint.name, status, query_count, seconds, peak_memory)
+
+
+def run_benchmarks(endpoints: Iterable[Endpoint]) -> List[Measurement]:
+    """Measure a request to each of the given endpoints."""
+    admin = User.objects.filter(is_superuser=True).first()
+    if admin is None:
+        admin = User.objects.create_superuser("benchmark", "benchmark@example.com", None)
+    clients = {False: Client(), True: Client()}
+    clients[True].force_login(admin)
+    return [measure(clients[endpoint.admin], endpoint) for endpoint in endpoints]
+
+
+def measure_serialization(data: SyntheticData, limit: int = 1000) -> List[SerializationMeasurement]:
+    """Measure the time used to list a page of rankings and skill history with and without the fast path.
+
+    The fast path builds lists from values (see `utils.ValuesListMixin`) and renders them with `FastJSONRenderer`
+    (which uses orjson if it's installed). The time used by the view (including its queries) is measured separately
+    from the time used to render its response.
+    """
+    act = data.activity_id
+    player_id = LeaderboardEntry.objects.filter(activity_id=act, position=1).values_list("player_id", flat=True).get()
+    lists: List[Tuple[str, Any, str, Dict[str, Any]]] = [
+        ("api-rankings", RankingViewSet, f"/api/rankings/?activity={act}&ordering=-skill&limit={limit}", {}),
+        (
+            "api-skill-history",
+            SkillHistoryViewSet,
+            f"/api/skill-history/{act}/{player_id}/?limit={limit}",
+            {"activity_url": act, "player_id": player_id},
+        ),
+    ]
+    factory = APIRequestFactory()
+    measurements = []
+    for name, viewset, path, kwargs in lists:
+        times = []
+        for initkwargs in [{"values_fields": None, "renderer_classes": [JSONRenderer]}, {}]:
+            view = viewset.as_view({"get": "list"}, **{"renderer_classes": [FastJSONRenderer], **initkwargs})
+            cache.clear()
+            start = time.perf_counter()
+            response = view(factory.get(path), **kwargs)
+            rendered = time.perf_counter()
+            response.render()
+            items = len(response.data)
+            scale = 1000 / max(items, 1)
+            times.append(((rendered - start) * scale, (time.perf_counter() - rendered) * scale))
+        (serialize_before, render_before), (serialize_after, render_after) = times
+        measurements.append(
+            SerializationMeasurement(name, items, serialize_before, serialize_after, render_before, render_after)
+        )
+    return measurements
+
+
+def find_budget_violations(measurements: Iterable[Measurement]) -> List[str]:
+    """Describe each measurement that used more queries than its endpoint's budget (see `QUERY_BUDGETS`)."""
+    return [
+        f"{measured.name}: {measured.queries} queries (budget: {QUERY_BUDGETS[measured.name]})"
+        for measured in measurements
+        if measured.queries > QUERY_BUDGETS[measured.name]
+    ]
+
+
+def format_table(measurements: Iterable[Measurement], previous: Optional[Iterable[Measurement]] = None) -> str:
+    """Format measurements as a table (comparing them to those of a previous run, if given)."""
+    previous_per_name = {measured.name: measured for measured in previous or []}
+    rows = [["Endpoint", "Status", "Queries", "Budget", "Time (ms)", "Peak memory (KiB)"]]
+    for measured in measurements:
+        before = previous_per_name.get(measured.name)
+        row = [
+            measured.name,
+            str(measured.status),
+            str(measured.queries),
+            str(QUERY_BUDGETS[measured.name]),
+            f"{measured.seconds * 1000:.1f}",
+            f"{measured.peak_memory / 1024:.0f}",
+        ]
+        if before is not None:
+            row[2] = f"{before.queries} -> {row[2]}"
+            row[4] = f"{before.seconds * 1000:.1f} -> {row[4]} ({change_str(before.seconds, measured.seconds)})"
+            memory_change = change_str(before.peak_memory, measured.peak_memory)
+            row[5] = f"{before.peak_memory / 1024:.0f} -> {row[5]} ({memory_change})"
+        rows.append(row)
+    widths = [max(len(row[idx]) for row in rows) for idx in range(len(rows[0]))]
+    return "\n".join("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows)
+
+
+def format_serialization_table(measurements: Iterable[SerializationMeasurement]) -> str:
+    """Format measurements of the time used to list items as a table."""
+    rows = [["List", "Items", "Serialize (ms per 1000 items)", "Render (ms per 1000 items)"]]
+    for measured in measurements:
+        rows.append(
+            [
+                measured.name,
+                str(measured.items),
+                f"{measured.serialize_before * 1000:.1f} -> {measured.serialize_after * 1000:.1f} "
+                f"({change_str(measured.serialize_before, measured.serialize_after)})",
+                f"{measured.render_before * 1000:.1f} -> {measured.render_after * 1000:.1f} "
+                f"({change_str(measured.render_before, measured.render_after)})",
+            ]
+        )
+    widths = [max(len(row[idx]) for row in rows) for idx in range(len(rows[0]))]
+    return "\n".join("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows)
+
+
+def change_str(before: float, after: float) -> str:
+    """Describe the relative change between two values as a percentage."""
+    if before == 0:
+        return "n/a"
+    return f"{(after - before) / before:+.0%}"
+
+
+def save_measurements(path: str, measurements: Iterable[Measurement]) -> None:
+    """Save measurements as JSON (so that they can be compared to those of later runs)."""
+    with open(path, "w") as file:
+        json.dump([measured._asdict() for measured in measurements], file, indent=2)
+
+
+def load_measurements(path: str) -> List[Measurement]:
+    """Load measurements saved with `save_measurements`."""
+    with open(path) as file:
+        return [Measurement(**measured) for measured in json.load(file)]
+
+
+def get_main_queries(activity_id: str, player_id: int, game_id: int) -> Dict[str, "QuerySet[Any]"]:
+    """Get the main queries used by the endpoints (and rating engine) for the given activity, player and game."""
+    sessions = GameSession.objects.filter(activity_id=activity_id)
+    keyset = KeysetPagination()
+    return {
+        "pending-matches": Game.objects.filter(session__activity=activity_id, session__validated=None).order_by(
+            *Game.NEWEST_FIRST
+        ),
+        "matches-page": Game.objects.filter(session__activity=activity_id, session__validated=1).order_by(
+            *Game.NEWEST_FIRST
+        )[:50],
+        "matches-after-cursor": sessions.filter(validated=1)
+        .filter(keyset.after([2**31, 2**31], descending=True))
+        .order_by(*keyset.get_ordering(descending=True))[:101],
+        "first-pending-session": sessions.filter(validated__isnull=True).order_by("datetime")[:1],
+        "validated-sessions": sessions.filter(validated=1, datetime__gte=0).order_by("datetime"),
+        "session-chunk": sessions.filter(validated=1)
+        .filter(Q(datetime__gt=0) | Q(datetime=0, id__gt=0))
+        .order_by("datetime", "id")
+        .values_list("id", "datetime")[:1000],
+        "session-games": Game.objects.filter(session__in=GameSession.objects.filter(id__in=range(1, 1001))).order_by(
+            "session__datetime", "session_id", "datetime", "position", "id"
+        ),
+        "game-results": Result.objects.filter(game_id=game_id).values_list("team_id", "ranking"),
+        "winning-team": Result.objects.filter(game_id=game_id, ranking=1)[:1],
+        "leaderboard": get_leaderboard(activity_id)[:5],
+        "rankings": RankingViewSet.list_queryset.filter(activity=activity_id).order_by("-skill")[:100],
+        "skill-history": SkillHistory.objects.filter(player_id=player_id, activity_id=activity_id).order_by(
+            "result__game__datetime", "id"
+        ),
+        "latest-checkpoint": RatingCheckpoint.objects.filter(activity=activity_id, datetime__lt=2**31).order_by(
+            "-datetime", "-session_id"
+        )[:1],
+        "export-matches": EXPORTS["matches"].get_queryset(activity_id),
+        "export-skill-history": EXPORTS["skill-history"].get_queryset(activity_id),
+    }
+
+
+def find_unindexed_steps(plan: str) -> List[str]:
+    """Find the steps of an (SQLite) query plan that don't use an index.
+
+    These scan a whole table, or sort all the rows in a temporary B-tree (instead of reading them in the order of an
+    index). Sorting only the right part of an order (i.e. the rows that are equal in its first columns, which are read
+    in order) is fine.
+    """
+    return [
+        step
+        for step in (line.strip(" |-`") for line in plan.splitlines())
+        if (" SCAN " in f" {step} " and "USING" not in step) or "USE TEMP B-TREE FOR ORDER BY" in step
+    ]
@@ -0,0 +1,150 @@
+"""Caching of responses per version of the data of an activity.
+
+Almost all pages and API responses of an activity only change when its matches are submitted, validated or
+invalidated, or its rankings are recalculated. Each of those increases the activity's data version (stored in the
+database, so that it's shared by all processes), and responses are cached per version, so that a cached response is
+used until the data changes (or the cache entry expires). Responses that aren't for a single activity (e.g. lists of
+players) use the versions of all activities, which are all increased when players or activities change.
+
+The version is also used for the ETag (and the time it changed for the Last-Modified header) of responses, so that
+clients can make conditional requests which are answered with "304 Not Modified" without generating the response.
+
+API responses are rendered in a media type (e.g. JSON or the browsable API's HTML) negotiated from the Accept header,
+so the key and ETag of a response also include (a digest of) that header.
+
+Only anonymous GET (and HEAD) requests are cached, so that the responses don't depend on the user (requests with an
+Authorization header, which the API authenticates after this, aren't cached either). The cache is
+Django's default cache (see `settings.CACHES`), which can be a local-memory (per process) or file-based (shared) cache.
+"""
+
+import hashlib
+import time
+from functools import wraps
+from http import HTTPStatus
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Max, Sum
+from django.http import HttpRequest, HttpResponse
+from django.template.response import SimpleTemplateResponse
+from django.utils.cache import get_cache_key, get_conditional_response, learn_cache_key
+from django.utils.http import http_date, quote_etag
+
+from .models import Activity, DataVersion
+from .registry import registry
+
+# Function that gets the lookup (e.g. {"activity__url": "tennis"}) of the activity of a request (from the request and
+# the view's keyword arguments), which is empty if the request isn't for a single activity.
+ActivityLookup = Callable[[HttpRequest, Dict[str, Any]], Dict[str, str]]
+
+
+def get_data_version(**lookup: str) -> Tuple[str, Optional[int]]:
+    """Get the version of the data of an activity (or of all activities if no lookup is given) and when it changed."""
+    if lookup:
+        version = DataVersion.objects.filter(**lookup).values_list("version", "modified").first()
+        return (str(version[0]), version[1]) if version is not None else ("0", None)
+    # Versions are only increased, but activities (and their versions) can also be deleted
+    versions = DataVersion.objects.aggregate(count=Count("pk"), total=Sum("version"), modified=Max("modified"))
+    return f"{versions['count']}.{versions['total'] or 0}", versions["modified"]
+
+
+def bump_data_versions(activity_ids: Optional[Iterable[str]] = None) -> None:
+    """Increase the data versions of the given activities (or all activities) so that their cached responses expire."""
+    ids = set(Activity.objects.values_list("id", flat=True) if activity_ids is None else activity_ids)
+    if len(ids) == 0:
+        return
+    DataVersion.objects.bulk_create(
+        [DataVersion(activity_id=activity_id) for activity_id in ids], ignore_conflicts=True
+    )
+    DataVersion.objects.filter(activity_id__in=ids).update(version=F("version") + 1, modified=int(time.time()))
+
+
+def bump_all_data_versions(sender: Any, **kwargs: Any) -> None:
+    """Expire the cached responses of all activities (handler of signals for changes to players and activities)."""
+    bump_data_versions()
+
+
+def all_activities(request: HttpRequest, kwargs: Dict[str, Any]) -> Dict[str, str]:
+    """Use the data of all activities for a request (that isn't for a single activity)."""
+    return {}
+
+
+def activity_from_path(request: HttpRequest, kwargs: Dict[str, Any]) -> Dict[str, str]:
+    """Get the activity of a request from the URL path (`activity_url`)."""
+    return {"activity__url": kwargs["activity_url"]}
+
+
+def activity_id_from_path(request: HttpRequest, kwargs: Dict[str, Any]) -> Dict[str, str]:
+    """Get the activity of a request from the URL path (`activity_url`, an activity URL or ID in the API)."""
+    return {"activity_id": registry.resolve_id(kwargs["activity_url"])}
+
+
+def activity_from_query(request: HttpRequest, kwargs: Dict[str, Any]) -> Dict[str, str]:
+    """Get the activity of a request from the `activity` query parameter (an activity ID), if given."""
+    activity_id = request.GET.get("activity")
+    return {"activity_id": activity_id} if activity_id else {}
+
+
+def store_response(request: HttpRequest, response: HttpResponse, key_prefix: str, timeout: int) -> None:
+    """Cache a response (once it's rendered) for later requests with the same key prefix."""
+
+    def store(response: HttpResponse) -> None:
+        cache.set(learn_cache_key(request, response, timeout, key_prefix, cache=cache), response, timeout)
+
+    # Template (and API) responses can only be cached once they're rendered
+    if isinstance(response, SimpleTemplateResponse) and not response.is_rendered:
+        response.add_post_render_callback(store)
+    else:
+        store(response)
+
+
+def cache_per_activity(lookup: ActivityLookup = activity_from_path) -> Callable[[Callable], Callable]:
+    """Cache the responses of a view per version of the data of their activity (see `DataVersion`).
+
+    Works like `django.views.decorators.cache.cache_page` (and `django.views.decorators.http.condition`), except that
+    the key (and ETag) includes the data version (and the Accept header).
+    """
+
+    def decorator(view: Callable) -> Callable:
+        @wraps(view)
+        def cached_view(request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+            user = getattr(request, "user", None)
+            if (
+                request.method not in ("GET", "HEAD")
+                or (user and user.is_authenticated)
+                or "Authorization" in request.headers
+            ):
+                return view(request, *args, **kwargs)
+
+            activity = lookup(request, kwargs)
+            version, modified = get_data_version(**activity)
+            # The media type of API responses is negotiated from the Accept header
+            accept = hashlib.sha256(request.headers.get("Accept", "").encode()).hexdigest()[:16]
+            key_prefix = ".".join(
+                ["activity", *(f"{field}={value}" for field, value in activity.items()), version, accept]
+            )
+            etag = quote_etag(key_prefix)
+            not_modified = get_conditional_response(request, etag=etag, last_modified=modified)
+            if not_modified is not None:
+                return not_modified
+
+            timeout = settings.RESPONSE_CACHE_TIMEOUT
+            cache_key = get_cache_key(request, key_prefix, "GET", cache=cache) if timeout > 0 else None
+            response = cache.get(cache_key) if cache_key is not None else None
+            if response is not None:
+                return response
+
+            response = view(request, *args, **kwargs)
+            if response.status_code != HTTPStatus.OK or response.streaming or response.cookies:
+                return response
+            response.headers.setdefault("ETag", etag)
+            if modified is not None:
+                response.headers.setdefault("Last-Modified", http_date(modified))
+            if timeout > 0 and request.method == "GET":
+                store_response(request, response, key_prefix, timeout)
+            return response
+
+        return cached_view
+
+    return decorator
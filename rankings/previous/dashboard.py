@@ -0,0 +1,72 @@
+"""Everything shown on the summary page (dashboard) of an activity, loaded with a fixed number of queries.
+
+The same data is returned by the `/api/dashboard/<activity>/` endpoint and rendered by the `activity_summary` view, so
+that the whole page can be loaded with a single request: the top players, the most recent (validated) and pending
+matches of the activity, and the list of players to choose from when submitting a match.
+"""
+
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from django.db.models import Prefetch, QuerySet, prefetch_related_objects
+
+from .models import Activity, AdhocTeam, Game, GameSession, LeaderboardEntry, Player, TeamMember, annotate_winning_team
+
+# Number of top players shown
+TOP_PLAYERS = 5
+# Number of the most recent validated matches shown
+RECENT_MATCHES = 10
+# Maximum number of pending matches returned by the dashboard API (the same as a page of matches in the API)
+PENDING_MATCHES = 100
+
+
+class Dashboard(NamedTuple):
+    """The data shown on the summary page of an activity."""
+
+    activity: Activity
+    top_players: List[LeaderboardEntry]
+    # Matches have their games (annotated with their winning team) and teams (with their members) prefetched
+    recent_matches: List[GameSession]
+    pending_matches: List[GameSession]
+    # IDs and names of all active players (ordered by name)
+    players: List[Tuple[int, str]]
+
+
+def get_leaderboard(activity_id: str) -> "QuerySet[LeaderboardEntry]":
+    """Get the (active) players on the leaderboard of an activity, in order of their position."""
+    return (
+        LeaderboardEntry.objects.filter(activity_id=activity_id, position__isnull=False, player__active=True)
+        .select_related("player")
+        # Same order as the positions, but can be read from the (activity, skill) index
+        .order_by("-skill", "player_id")
+    )
+
+
+def prefetch_match_details(sessions: Iterable[GameSession]) -> None:
+    """Load the games and teams of matches (in the same way as `api.MatchViewSet`) with a fixed number of queries."""
+    members = Prefetch("teammember_set", queryset=TeamMember.objects.select_related("player").order_by("id"))
+    prefetch_related_objects(
+        list(sessions),
+        Prefetch("game_set", queryset=annotate_winning_team(Game.objects.order_by("position", "id"))),
+        Prefetch("adhocteam_set", queryset=AdhocTeam.objects.order_by("id").prefetch_related(members)),
+    )
+
+
+def get_dashboard(
+    activity: Activity, recent_matches: int = RECENT_MATCHES, pending_matches: Optional[int] = None
+) -> Dashboard:
+    """Load the data shown on the summary page of an activity.
+
+    Includes the given number of recent matches and (at most) the given number of pending matches (all if None).
+    """
+    sessions = GameSession.objects.filter(activity=activity).order_by("-datetime", "-id")
+    recent = list(sessions.filter(validated=1)[:recent_matches]) if recent_matches > 0 else []
+    pending = sessions.filter(validated__isnull=True)
+    pending = list(pending if pending_matches is None else pending[:pending_matches])
+    prefetch_match_details(recent + pending)
+    return Dashboard(
+        activity=activity,
+        top_players=list(get_leaderboard(activity.id)[:TOP_PLAYERS]),
+        recent_matches=recent,
+        pending_matches=pending,
+        players=list(Player.objects.filter(active=True).order_by("name", "id").values_list("id", "name")),
+    )
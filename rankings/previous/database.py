@@ -0,0 +1,32 @@
+"""Performance tuning of (SQLite) database connections.
+
+The pragmas in `settings.SQLITE_PRAGMAS` are set whenever a new connection is created, since most of them only apply
+to the connection that sets them.
+"""
+
+import re
+from typing import Any, Dict
+
+from django.conf import settings
+from django.db.backends.base.base import BaseDatabaseWrapper
+
+# Pragma values are included in the SQL as-is (since they can't be query parameters), so only allow simple values
+PRAGMA_VALUE = re.compile(r"-?\w+")
+
+
+def apply_sqlite_pragmas(cursor: Any, pragmas: Dict[str, str]) -> None:
+    """Set the given pragmas (skipping empty values) using a DB-API cursor of an SQLite connection."""
+    for name, value in pragmas.items():
+        if not value:
+            continue
+        if not PRAGMA_VALUE.fullmatch(value):
+            raise ValueError(f"Invalid value for SQLite pragma {name}: {value!r}")
+        cursor.execute(f"PRAGMA {name} = {value}")
+
+
+def configure_connection(sender: Any, connection: BaseDatabaseWrapper, **kwargs: Any) -> None:
+    """Tune a newly created database connection (handler of the `connection_created` signal)."""
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        apply_sqlite_pragmas(cursor, settings.SQLITE_PRAGMAS)
@@ -0,0 +1,129 @@
+"""Export of the full history of an activity (its matches or its skill history) as a stream of flat rows.
+
+Each export is a single query of flat rows (one per player per team per game for matches, and one per player per game
+for skill history) that is read in chunks with `.iterator()` and encoded (and optionally compressed) a chunk at a time,
+so that the memory used doesn't depend on the size of the history. Rows can be encoded as newline-delimited JSON
+(one object per line) or as CSV (with a header row).
+"""
+
+import csv
+import io
+import json
+import zlib
+from typing import Any, Callable, Dict, Iterable, Iterator, NamedTuple, Sequence, Tuple
+
+from django.db.models import QuerySet
+
+from .api import SKILL_EXPRESSION
+from .models import Result, SkillHistory
+from .ratings import batched
+
+# Number of rows read from the database (and encoded) at a time
+CHUNK_SIZE = 2000
+# Content types of the formats in which rows can be encoded
+CONTENT_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+class Export(NamedTuple):
+    """The rows of a table that can be exported."""
+
+    # Names of the columns and the lookups used to query them
+    columns: Dict[str, str]
+    # All the rows of an activity (given its ID), in order
+    get_queryset: Callable[[str], QuerySet]
+
+
+def get_match_rows(activity_id: str) -> QuerySet:
+    """Get the results of all matches of an activity, with a row for each member of each team in each game."""
+    return Result.objects.filter(game__session__activity_id=activity_id).order_by(
+        "game__session__datetime", "game__session_id", "game__position", "game_id", "team_id", "team__teammember__id"
+    )
+
+
+def get_skill_history_rows(activity_id: str) -> QuerySet:
+    """Get the skill history of all players in an activity, with a row for each player after each game."""
+    # History is saved in the order in which games are rated (and replaced from the first changed game onwards), so
+    # its IDs are chronological, and ordering by them is served by the activity index without sorting
+    return SkillHistory.objects.filter(activity_id=activity_id).annotate(skill=SKILL_EXPRESSION).order_by("id")
+
+
+EXPORTS = {
+    "matches": Export(
+        columns={
+            "match_id": "game__session_id",
+            "match_datetime": "game__session__datetime",
+            "validated": "game__session__validated",
+            "submittor": "game__session__submittor",
+            "game_id": "game_id",
+            "game_position": "game__position",
+            "game_datetime": "game__datetime",
+            "team_id": "team_id",
+            "ranking": "ranking",
+            "player_id": "team__teammember__player_id",
+            "player_name": "team__teammember__player__name",
+        },
+        get_queryset=get_match_rows,
+    ),
+    "skill-history": Export(
+        columns={
+            "match_id": "result__game__session_id",
+            "game_id": "result__game_id",
+            "datetime": "result__game__datetime",
+            "player_id": "player_id",
+            "player_name": "player__name",
+            "skill": "skill",
+            "mu": "mu",
+            "sigma": "sigma",
+        },
+        get_queryset=get_skill_history_rows,
+    ),
+}
+
+
+def iter_rows(table: str, activity_id: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[Any, ...]]:
+    """Read all the rows of a table (see `EXPORTS`) of an activity, a chunk at a time."""
+    export = EXPORTS[table]
+    queryset = export.get_queryset(activity_id).values_list(*export.columns.values())
+    return queryset.iterator(chunk_size=chunk_size)  # type: ignore[no-any-return]
+
+
+def encode_ndjson(columns: Sequence[str], rows: Iterable[Tuple[Any, ...]], chunk_size: int) -> Iterator[bytes]:
+    """Encode rows as JSON objects, one per line."""
+    for batch in batched(rows, chunk_size):
+        yield "".join(json.dumps(dict(zip(columns, row))) + "\n" for row in batch).encode()
+
+
+def encode_csv(columns: Sequence[str], rows: Iterable[Tuple[Any, ...]], chunk_size: int) -> Iterator[bytes]:
+    """Encode rows as CSV, starting with a header row."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in batched(rows, chunk_size):
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    # Only the header is left if there are no rows
+    if buffer.tell() > 0:
+        yield buffer.getvalue().encode()
+
+
+ENCODERS = {"ndjson": encode_ndjson, "csv": encode_csv}
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Compress chunks of data (in the gzip format) as they're produced."""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_history(
+    table: str, activity_id: str, file_format: str, *, compress: bool = False, chunk_size: int = CHUNK_SIZE
+) -> Iterator[bytes]:
+    """Export all the rows of a table (see `EXPORTS`) of an activity in a format (see `ENCODERS`), chunk by chunk."""
+    chunks = ENCODERS[file_format](list(EXPORTS[table].columns), iter_rows(table, activity_id, chunk_size), chunk_size)
+    return gzip_chunks(chunks) if compress else chunks
@@ -0,0 +1,288 @@
+"""Bulk import of (historical) matches from flat rows, e.g. as exported by `export` (the "matches" table).
+
+Each row describes one player in one team in one game of a match (see `COLUMNS`). Rows are read as a stream and
+grouped into matches (consecutive rows with the same `match_id`), which are inserted in batches: each batch is
+validated (each match must have a ranking for every team in every game, be within the team and player limits of the
+activity and not have a player in several teams, and its new players are checked with a single query) and inserted with
+`bulk_create` in its own transaction, so that memory use doesn't depend on the size of the input. If a batch is invalid,
+the batches before it remain imported.
+
+The IDs of matches, games and teams in the input are only used to group rows (new IDs are assigned), while players are
+identified by their (existing) IDs.
+"""
+
+import csv
+import json
+import time
+from itertools import groupby
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set
+
+from django.db import transaction
+
+from .cache import bump_data_versions
+from .models import Activity, AdhocTeam, Game, GameSession, Player, Result, TeamMember
+from .ratings import BULK_BATCH_SIZE, batched
+
+# Number of matches inserted per transaction
+IMPORT_BATCH_SIZE = 1000
+# Columns of the rows, and whether each is required (the others have defaults)
+COLUMNS = {
+    "match_id": True,
+    "match_datetime": False,
+    "validated": False,
+    "submittor": False,
+    "game_id": False,
+    "game_position": False,
+    "game_datetime": False,
+    "team_id": True,
+    "ranking": True,
+    "player_id": True,
+}
+# Submittor of imported matches that don't specify one
+DEFAULT_SUBMITTOR = "import"
+
+# Called with the number of rows and matches imported so far
+ImportProgressCallback = Callable[[int, int], None]
+
+
+class ImportedGame(NamedTuple):
+    """A game of an imported match."""
+
+    position: int
+    datetime: int
+    # Ranking of each team (by its ID in the input)
+    rankings: Dict[str, Optional[int]]
+
+
+class ImportedMatch(NamedTuple):
+    """A match (session) read from the input, with its teams and games (by their IDs in the input)."""
+
+    # Number of its first row (starting at 1), for error messages
+    first_row: int
+    rows: int
+    datetime: int
+    validated: Optional[int]
+    submittor: str
+    # IDs of the players of each team
+    teams: Dict[str, List[int]]
+    games: Dict[str, ImportedGame]
+
+
+class ImportResult(NamedTuple):
+    """Summary of an import."""
+
+    rows: int
+    matches: int
+    # Datetime of the earliest validated match imported (from which ratings have to be recalculated), if any
+    earliest_validated: Optional[int]
+
+
+class ImportStoppedError(ValueError):
+    """Error in a batch of an import, after the earlier batches were imported (as summarized by `result`)."""
+
+    def __init__(self, message: str, result: ImportResult):
+        super().__init__(message)
+        self.result = result
+
+
+def decode_ndjson(lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """Decode rows from JSON objects, one per line (skipping empty lines)."""
+    return (json.loads(line) for line in lines if line.strip())
+
+
+def decode_csv(lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """Decode rows from CSV with a header row."""
+    return iter(csv.DictReader(lines))
+
+
+DECODERS = {"ndjson": decode_ndjson, "csv": decode_csv}
+
+
+def to_int(value: Any) -> Optional[int]:
+    """Convert a value of a row (a string in CSV) to an integer (None if it's empty)."""
+    if value is None or value == "":
+        return None
+    return int(value)
+
+
+def read_match(first_row: int, rows: List[Dict[str, Any]], default_datetime: int) -> ImportedMatch:
+    """Combine the rows of a match."""
+    first = rows[0]
+    match_datetime = to_int(first.get("match_datetime")) or default_datetime
+    # Matches without a "validated" column are historical (i.e. validated), but it can also be left empty (pending)
+    validated = to_int(first["validated"]) if "validated" in first else 1
+    teams: Dict[str, List[int]] = {}
+    games: Dict[str, ImportedGame] = {}
+    for row_number, row in enumerate(rows, first_row):
+        team_id = str(row["team_id"])
+        game_id = str(row.get("game_id") or "")
+        game = games.get(game_id)
+        if game is None:
+            position = to_int(row.get("game_position")) or 0
+            game = games[game_id] = ImportedGame(position, to_int(row.get("game_datetime")) or match_datetime, {})
+        game.rankings[team_id] = to_int(row["ranking"])
+        members = teams.setdefault(team_id, [])
+        player_id = to_int(row["player_id"])
+        if player_id is None:
+            raise ValueError(f"Row {row_number}: missing player_id")
+        if player_id not in members:
+            members.append(player_id)
+    return ImportedMatch(
+        first_row=first_row,
+        rows=len(rows),
+        datetime=match_datetime,
+        validated=validated,
+        submittor=str(first.get("submittor") or DEFAULT_SUBMITTOR),
+        teams=teams,
+        games=games,
+    )
+
+
+def read_matches(rows: Iterable[Dict[str, Any]], default_datetime: Optional[int] = None) -> Iterator[ImportedMatch]:
+    """Group (consecutive) rows by match.
+
+    Matches without a datetime get the given one (the current time by default).
+    """
+    if default_datetime is None:
+        default_datetime = int(time.time())
+    row_number = 1
+    for match_id, match_rows in groupby(rows, key=lambda row: row.get("match_id")):
+        match_rows_list = list(match_rows)
+        missing = [column for column, required in COLUMNS.items() if required and column not in match_rows_list[0]]
+        if missing:
+            raise ValueError(f"Row {row_number}: missing columns: {', '.join(missing)}")
+        if match_id is None or match_id == "":
+            raise ValueError(f"Row {row_number}: missing match_id")
+        yield read_match(row_number, match_rows_list, default_datetime)
+        row_number += len(match_rows_list)
+
+
+def format_limits(minimum: int, maximum: Optional[int]) -> str:
+    """Describe the allowed range of a count."""
+    if maximum is None:
+        return f"at least {minimum}"
+    return str(minimum) if minimum == maximum else f"{minimum} to {maximum}"
+
+
+def check_match(activity: Activity, match: ImportedMatch) -> None:
+    """Check that a match is complete and within the limits of the activity (as the rating engine expects)."""
+    min_teams = max(activity.min_teams_per_match, 2)
+    max_teams = activity.max_teams_per_match
+    if len(match.teams) < min_teams or (max_teams is not None and len(match.teams) > max_teams):
+        limits = format_limits(min_teams, max_teams)
+        raise ValueError(f"Row {match.first_row}: {len(match.teams)} teams (expected {limits})")
+    min_players = activity.min_players_per_team
+    max_players = activity.max_players_per_team
+    for team_id, player_ids in match.teams.items():
+        if len(player_ids) < min_players or (max_players is not None and len(player_ids) > max_players):
+            limits = format_limits(min_players, max_players)
+            raise ValueError(f"Row {match.first_row}: team {team_id} has {len(player_ids)} players (expected {limits})")
+    player_ids = [player_id for team in match.teams.values() for player_id in team]
+    if len(set(player_ids)) != len(player_ids):
+        repeated = sorted({player_id for player_id in player_ids if player_ids.count(player_id) > 1})
+        raise ValueError(f"Row {match.first_row}: players in several teams: {', '.join(map(str, repeated))}")
+    for game_id, game in match.games.items():
+        missing = sorted(team_id for team_id in match.teams if game.rankings.get(team_id) is None)
+        if missing:
+            raise ValueError(f"Row {match.first_row}: game {game_id!r} has no ranking for teams: {', '.join(missing)}")
+
+
+def check_players(matches: List[ImportedMatch], known_players: Set[int]) -> None:
+    """Check that all players of the matches exist (querying those that aren't known yet, which are then added)."""
+    player_ids = {player_id for match in matches for team in match.teams.values() for player_id in team}
+    new_ids = player_ids - known_players
+    if new_ids:
+        known_players.update(Player.objects.filter(id__in=new_ids).values_list("id", flat=True))
+    for match in matches:
+        unknown = sorted(set(player_id for team in match.teams.values() for player_id in team) - known_players)
+        if unknown:
+            raise ValueError(f"Row {match.first_row}: unknown players: {', '.join(map(str, unknown))}")
+
+
+def save_matches(activity_id: str, matches: List[ImportedMatch]) -> None:
+    """Insert matches (with their games, teams, results and team members) with a fixed number of queries."""
+    with transaction.atomic():
+        sessions = GameSession.objects.bulk_create(
+            (
+                GameSession(
+                    activity_id=activity_id,
+                    datetime=match.datetime,
+                    submittor=match.submittor,
+                    validated=match.validated,
+                )
+                for match in matches
+            ),
+            batch_size=BULK_BATCH_SIZE,
+        )
+        games = Game.objects.bulk_create(
+            (
+                Game(session=session, position=game.position, datetime=game.datetime, submittor=match.submittor)
+                for session, match in zip(sessions, matches)
+                for game in match.games.values()
+            ),
+            batch_size=BULK_BATCH_SIZE,
+        )
+        teams = AdhocTeam.objects.bulk_create(
+            (AdhocTeam(session=session) for session, match in zip(sessions, matches) for _ in match.teams),
+            batch_size=BULK_BATCH_SIZE,
+        )
+
+        results: List[Result] = []
+        members: List[TeamMember] = []
+        new_games = iter(games)
+        new_teams = iter(teams)
+        for match in matches:
+            team_per_id: Dict[str, AdhocTeam] = {}
+            for team_id, player_ids in match.teams.items():
+                team = team_per_id[team_id] = next(new_teams)
+                members.extend(TeamMember(team=team, player_id=player_id) for player_id in player_ids)
+            for imported_game in match.games.values():
+                game = next(new_games)
+                results.extend(
+                    Result(
+                        game=game,
+                        team=team_per_id[team_id],
+                        ranking=ranking,
+                        datetime=imported_game.datetime,
+                        submittor=match.submittor,
+                    )
+                    for team_id, ranking in imported_game.rankings.items()
+                )
+        Result.objects.bulk_create(results, batch_size=BULK_BATCH_SIZE)
+        TeamMember.objects.bulk_create(members, batch_size=BULK_BATCH_SIZE)
+        bump_data_versions([activity_id])
+
+
+def import_matches(
+    activity: Activity,
+    rows: Iterable[Dict[str, Any]],
+    batch_size: int = IMPORT_BATCH_SIZE,
+    progress: Optional[ImportProgressCallback] = None,
+) -> ImportResult:
+    """Import matches into an activity from rows (see the module's description) in batches of matches.
+
+    Each batch is checked (see `check_match` and `check_players`) before it's inserted. Ratings aren't updated, which
+    can be done once for all imported matches (from `earliest_validated`). An invalid batch stops the import with an
+    `ImportStoppedError`, which summarizes the batches that were imported before it.
+    """
+    row_count = 0
+    match_count = 0
+    earliest_validated: Optional[int] = None
+    known_players: Set[int] = set()
+    try:
+        for matches in batched(read_matches(rows), batch_size):
+            for match in matches:
+                check_match(activity, match)
+            check_players(matches, known_players)
+            save_matches(activity.id, matches)
+
+            row_count += sum(match.rows for match in matches)
+            match_count += len(matches)
+            for match in matches:
+                if match.validated == 1 and (earliest_validated is None or match.datetime < earliest_validated):
+                    earliest_validated = match.datetime
+            if progress is not None:
+                progress(row_count, match_count)
+    except (ValueError, KeyError) as e:
+        raise ImportStoppedError(str(e), ImportResult(row_count, match_count, earliest_validated)) from e
+    return ImportResult(row_count, match_count, earliest_validated)
@@ -0,0 +1,134 @@
+"""Queue of background jobs for recalculating skill rankings.
+
+Recalculations can take a long time, so rather than running them within a request, jobs are stored in the database
+and processed by a separate worker process (see the `rankings_worker` management command).
+"""
+
+import datetime
+import logging
+import time
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db.models import Min, Q, QuerySet
+
+from .models import Activity, GameSession, RecalculationJob
+from .ratings import batch_update_player_skills, recalculate_all_activities, recalculate_player_skills_from
+
+logger = logging.getLogger(__name__)
+
+# Minimum number of seconds between each update of a running job's progress.
+PROGRESS_UPDATE_INTERVAL = 1.0
+
+
+def enqueue_recalculation(
+    activity: Optional[Activity], after_date: Optional[datetime.date] = None, from_datetime: Optional[int] = None
+) -> RecalculationJob:
+    """Add a job to the queue to recalculate the skill rankings of an activity (or of all activities if not given).
+
+    Either all games are reconsidered (optionally only those after a given date), or, when `from_datetime` is given,
+    only those after the closest checkpoint before that time.
+    """
+    return RecalculationJob.objects.create(
+        activity=activity, after_date=after_date, from_datetime=from_datetime, created=time.time()
+    )
+
+
+def find_earliest_validated(sessions: "QuerySet[GameSession]") -> Dict[str, int]:
+    """Find the datetime of the earliest validated session (per activity) among the given sessions.
+
+    Changes to these sessions affect the skill rankings from that time onwards.
+    """
+    earliest = sessions.filter(validated=1).order_by().values("activity_id").annotate(earliest=Min("datetime"))
+    return {row["activity_id"]: row["earliest"] for row in earliest}
+
+
+def enqueue_recalculations_from(earliest_changes: Dict[str, int]) -> List[RecalculationJob]:
+    """Queue jobs to recalculate skill rankings of each activity from the given time (see `find_earliest_validated`)."""
+    return [
+        RecalculationJob.objects.create(activity_id=activity_id, from_datetime=from_datetime, created=time.time())
+        for activity_id, from_datetime in earliest_changes.items()
+    ]
+
+
+def is_recalculating(activity_id: str) -> bool:
+    """Check if the skill rankings of an activity are being recalculated, or are queued to be, by a job."""
+    unfinished = RecalculationJob.objects.filter(status__in=[RecalculationJob.QUEUED, RecalculationJob.RUNNING])
+    return unfinished.filter(Q(activity_id=activity_id) | Q(activity__isnull=True)).exists()
+
+
+def requeue_stale_jobs(timeout: float) -> int:
+    """Queue jobs again whose worker hasn't reported any progress for longer than the timeout (in seconds).
+
+    Running jobs update their heartbeat along with their progress, so jobs with an older heartbeat have most likely
+    been abandoned, e.g. since their worker died. Returns the number of jobs queued again.
+    """
+    cutoff = time.time() - timeout
+    stale = Q(heartbeat__lt=cutoff) | Q(heartbeat__isnull=True, started__lt=cutoff)
+    return (
+        RecalculationJob.objects.filter(status=RecalculationJob.RUNNING)
+        .filter(stale)
+        .update(status=RecalculationJob.QUEUED, started=None, heartbeat=None, games_processed=0)
+    )
+
+
+def claim_next_job() -> Optional[RecalculationJob]:
+    """Claim the oldest queued job so that it can be processed (returns None if the queue is empty).
+
+    Jobs are claimed by atomically changing their status, so that multiple workers won't process the same job.
+    """
+    while True:
+        job = RecalculationJob.objects.filter(status=RecalculationJob.QUEUED).order_by("id").first()
+        if job is None:
+            return None
+        now = time.time()
+        claimed = RecalculationJob.objects.filter(id=job.id, status=RecalculationJob.QUEUED).update(
+            status=RecalculationJob.RUNNING, started=now, heartbeat=now
+        )
+        if claimed == 1:
+            job.refresh_from_db()
+            return job
+
+
+def run_job(job: RecalculationJob) -> None:
+    """Run a claimed job while recording its progress (and heartbeat) and final status.
+
+    Recalculations report their progress outside of their transactions (see `SessionReplay`), so that it's visible to
+    other connections while they run.
+    """
+    last_update = 0.0
+
+    def record_progress(processed: int, total: int) -> None:
+        nonlocal last_update
+        now = time.time()
+        if now - last_update < PROGRESS_UPDATE_INTERVAL and processed < total:
+            return
+        last_update = now
+        RecalculationJob.objects.filter(id=job.id).update(games_processed=processed, games_total=total, heartbeat=now)
+
+    after_date = None
+    if job.after_date is not None:
+        after_date = (job.after_date.year, job.after_date.month, job.after_date.day)
+    try:
+        if job.activity_id is None:
+            recalculate_all_activities(settings.RATING_WORKERS, progress=record_progress)
+        elif job.from_datetime is not None:
+            recalculate_player_skills_from(job.activity_id, job.from_datetime, progress=record_progress)
+        else:
+            batch_update_player_skills(job.activity_id, after_date, progress=record_progress)
+    except Exception as exc:
+        logger.exception("Recalculation job %s failed", job.id)
+        RecalculationJob.objects.filter(id=job.id).update(
+            status=RecalculationJob.FAILED, finished=time.time(), error=repr(exc)
+        )
+        return
+    RecalculationJob.objects.filter(id=job.id).update(status=RecalculationJob.DONE, finished=time.time())
+
+
+def process_queued_jobs() -> int:
+    """Process jobs until the queue is empty and return the number of jobs processed."""
+    count = 0
+    while (job := claim_next_job()) is not None:
+        run_job(job)
+        count += 1
+    return count
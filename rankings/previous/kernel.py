@@ -0,0 +1,134 @@
+"""Vectorised TrueSkill updates for batches of independent two-team games.
+
+`trueskill.rate()` builds and runs a factor graph for every game, while for two teams (without a draw) the update has
+a closed form that can be calculated for a whole batch of games at once with NumPy. Games are only independent if
+they don't share any players, so batches are only built from consecutive games with distinct players.
+
+NumPy is an optional dependency: `is_available()` should be checked before using this module.
+"""
+
+from typing import Any, Hashable, List, Sequence, Set, Tuple
+
+import trueskill
+from trueskill import Rating
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None  # type: ignore[assignment]
+
+# Coefficients of the approximation of erfc() used by `trueskill` (from Numerical Recipes), which we also use to
+# get the same results.
+ERFC_COEFFS = (
+    -1.26551223,
+    1.00002368,
+    0.37409196,
+    0.09678418,
+    -0.18628806,
+    0.27886807,
+    -1.13520398,
+    1.48851587,
+    -0.82215223,
+    0.17087277,
+)
+
+
+def is_available() -> bool:
+    """Check if the optional dependency (NumPy) required by this module is installed."""
+    return np is not None
+
+
+def is_supported(teams: Sequence[Sequence[int]], ranks: Sequence[int]) -> bool:
+    """Check if a game can be rated with this module (only two teams where one of them won)."""
+    return len(teams) == 2 and ranks[0] != ranks[1] and all(len(team) > 0 for team in teams)  # noqa: PLR2004
+
+
+def erfc(x: Any) -> Any:
+    """Calculate the complementary error function in the same way as `trueskill.backends.erfc`."""
+    z = np.abs(x)
+    t = 1.0 / (1.0 + z / 2.0)
+    poly = np.zeros_like(t)
+    for coeff in reversed(ERFC_COEFFS[1:]):
+        poly = t * (coeff + poly)
+    r = t * np.exp(-z * z + ERFC_COEFFS[0] + poly)
+    return np.where(x < 0, 2.0 - r, r)
+
+
+def rate_two_team_games(mu: Any, sigma: Any, game_idx: Any, won: Any, env: trueskill.TrueSkill) -> Tuple[Any, Any]:
+    """Calculate new ratings of all players in a batch of two-team games (none of which share players).
+
+    All arrays are per player: `game_idx` is the index of the game they played and `won` whether their team won.
+    """
+    n_games = int(game_idx.max()) + 1
+    sign = np.where(won, 1.0, -1.0)
+    # Add dynamics (tau) to the prior and the performance variance (beta) of each player.
+    var = sigma**2 + env.tau**2
+    c_squared = np.bincount(game_idx, weights=var + env.beta**2, minlength=n_games)
+    c = np.sqrt(c_squared)
+    size = np.bincount(game_idx, minlength=n_games)
+    draw_margin = env.ppf((env.draw_probability + 1) / 2.0) * np.sqrt(size) * env.beta
+    # Difference in the performance of the winning and losing team (per game).
+    mean_diff = np.bincount(game_idx, weights=sign * mu, minlength=n_games)
+
+    x = (mean_diff - draw_margin) / c
+    cdf = 0.5 * erfc(-x / np.sqrt(2))
+    pdf = np.exp(-(x**2) / 2) / np.sqrt(2 * np.pi)
+    v = np.divide(pdf, cdf, out=-x, where=cdf != 0)
+    w = v * (v + x)
+    if not np.all((w > 0) & (w < 1)):
+        # Same error as `trueskill` (which suggests using a backend with higher precision).
+        raise FloatingPointError("Rating update failed due to floating-point precision")
+
+    new_mu = mu + sign * var / c[game_idx] * v[game_idx]
+    new_sigma = np.sqrt(var * (1 - var / c_squared[game_idx] * w[game_idx]))
+    return new_mu, new_sigma
+
+
+class TwoTeamBatch:
+    """A batch of independent two-team games to be rated at once."""
+
+    def __init__(self, env: trueskill.TrueSkill):
+        self.env = env
+        self.games: List[Tuple[Hashable, Sequence[Sequence[int]], Sequence[int]]] = []
+        self.players: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self.games)
+
+    def conflicts(self, teams: Sequence[Sequence[int]]) -> bool:
+        """Check if any of the players of a game are already part of the batch."""
+        return any(player_id in self.players for team in teams for player_id in team)
+
+    def add(self, key: Hashable, teams: Sequence[Sequence[int]], ranks: Sequence[int]) -> None:
+        """Add a (supported) game to the batch."""
+        self.games.append((key, teams, ranks))
+        self.players.update(player_id for team in teams for player_id in team)
+
+    def rate(self, ratings: Any) -> List[Tuple[Hashable, List[List[Rating]]]]:
+        """Calculate the new ratings of all players per team for each game (and clear the batch)."""
+        player_ids: List[int] = []
+        game_idx: List[int] = []
+        won: List[bool] = []
+        for idx, (_, teams, ranks) in enumerate(self.games):
+            winner = 0 if ranks[0] < ranks[1] else 1
+            for team_idx, team in enumerate(teams):
+                player_ids.extend(team)
+                game_idx.extend([idx] * len(team))
+                won.extend([team_idx == winner] * len(team))
+        mu = np.array([ratings[player_id].mu for player_id in player_ids], dtype=np.float64)
+        sigma = np.array([ratings[player_id].sigma for player_id in player_ids], dtype=np.float64)
+        new_mu, new_sigma = rate_two_team_games(mu, sigma, np.array(game_idx), np.array(won), self.env)
+
+        rated = []
+        pos = 0
+        for key, teams, _ in self.games:
+            team_ratings = []
+            for team in teams:
+                team_ratings.append(
+                    [Rating(float(new_mu[pos + i]), float(new_sigma[pos + i])) for i in range(len(team))]
+                )
+                pos += len(team)
+            rated.append((key, team_ratings))
+        self.games = []
+        self.players = set()
+        return rated
@@ -0,0 +1 @@
+"""Django management utilities for this app."""
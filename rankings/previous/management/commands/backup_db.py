@@ -0,0 +1,50 @@
+"""Management command for backing up the database while the site is running."""
+
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from previous.backup import backup_database, rotate_backups
+
+
+class Command(BaseCommand):
+    """Back up the (SQLite) database with SQLite's online backup API (see `previous.backup`)."""
+
+    help = "Back up the database to a folder (consistently, while it's in use) and remove old backups."
+
+    def add_arguments(self, parser):
+        """Define command-line arguments."""
+        parser.add_argument("folder", help="Folder in which to store the backup.")
+        parser.add_argument("--source", help="Database file to back up (defaults to the configured database).")
+        parser.add_argument("--compress", action="store_true", help="Compress the backup with gzip.")
+        parser.add_argument("--no-verify", action="store_true", help="Don't check the integrity of the backup.")
+        parser.add_argument(
+            "--keep",
+            type=int,
+            default=0,
+            help="Number of backups (made by this command) to keep in the folder (default: 0, keep all).",
+        )
+
+    def handle(self, *args, **options):
+        """Run the backup."""
+        source = options["source"]
+        if source is None:
+            if connection.vendor != "sqlite":
+                raise CommandError("Only SQLite databases can be backed up")
+            source = str(connection.settings_dict["NAME"])
+        if not os.path.isfile(source):
+            raise CommandError(f"Database not found: {source}")
+        os.makedirs(options["folder"], exist_ok=True)
+
+        start = time.time()
+        try:
+            path = backup_database(source, options["folder"], options["compress"], not options["no_verify"])
+        except ValueError as e:
+            raise CommandError(str(e)) from e
+        self.stdout.write(f"Backed up {source} to {path} in {time.time() - start:.2f}s")
+
+        if options["keep"] > 0:
+            for removed in rotate_backups(options["folder"], source, options["keep"]):
+                self.stdout.write(f"Removed old backup {removed}")
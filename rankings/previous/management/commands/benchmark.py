@@ -0,0 +1,65 @@
+"""Management command for benchmarking all endpoints against a large synthetic database."""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from previous.benchmarks import (
+    find_budget_violations,
+    find_unbenchmarked_routes,
+    format_serialization_table,
+    format_table,
+    generate_data,
+    get_endpoints,
+    load_measurements,
+    measure_serialization,
+    run_benchmarks,
+    save_measurements,
+)
+
+
+class Command(BaseCommand):
+    """Measure the queries, time and memory used by each endpoint (see `previous.benchmarks`)."""
+
+    help = "Benchmark all endpoints against a synthetic (test) database and check their query budgets."
+
+    def add_arguments(self, parser):
+        """Define command-line arguments."""
+        parser.add_argument("--players", type=int, default=2000, help="Number of players to generate (default: 2000).")
+        parser.add_argument(
+            "--games", type=int, default=100000, help="Number of matches to generate (default: 100000)."
+        )
+        parser.add_argument("--save", help="Save the measurements to this (JSON) file.")
+        parser.add_argument("--compare", help="Compare the measurements to those saved by a previous run (see --save).")
+
+    def handle(self, *args, **options):
+        """Run the benchmarks."""
+        previous = load_measurements(options["compare"]) if options["compare"] else None
+        setup_test_environment()
+        # Never use the real database
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            start = time.time()
+            data = generate_data(options["players"], options["games"])
+            self.stdout.write(
+                f"Generated {options['players']} players and {options['games']} matches in {time.time() - start:.2f}s"
+            )
+            endpoints = get_endpoints(data)
+            measurements = run_benchmarks(endpoints)
+            serialization = measure_serialization(data)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(format_table(measurements, previous))
+        self.stdout.write("\nListing items with serializers -> values (and orjson, if installed):")
+        self.stdout.write(format_serialization_table(serialization))
+        if options["save"]:
+            save_measurements(options["save"], measurements)
+        for route in find_unbenchmarked_routes(endpoints):
+            self.stderr.write(f"Route not benchmarked: {route}")
+        violations = find_budget_violations(measurements)
+        if violations:
+            raise CommandError("Query budgets exceeded:\n" + "\n".join(violations))
@@ -0,0 +1,43 @@
+"""Management command for showing the query plans of the main queries used by the endpoints."""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from previous.benchmarks import UNINDEXED_QUERIES, find_unindexed_steps, get_main_queries
+from previous.models import Activity, Game, Player
+
+
+class Command(BaseCommand):
+    """Show the query plan of each of the main queries (see `previous.benchmarks.get_main_queries`)."""
+
+    help = "Show the query plans (EXPLAIN QUERY PLAN) of the main queries used by the endpoints."
+
+    def add_arguments(self, parser):
+        """Define command-line arguments."""
+        parser.add_argument("--activity", help="URL of the activity to query (default: the first one).")
+        parser.add_argument(
+            "--check", action="store_true", help="Fail if any query scans a whole table or sorts without an index."
+        )
+
+    def handle(self, *args, **options):
+        """Explain the queries."""
+        activity = Activity.objects.filter(**({"url": options["activity"]} if options["activity"] else {})).first()
+        if activity is None:
+            raise CommandError("No such activity")
+        # Any (existing) player and game will do, since only the shape of the queries matters
+        player_id = Player.objects.values_list("id", flat=True).first() or 0
+        game_id = Game.objects.values_list("id", flat=True).first() or 0
+
+        unindexed = []
+        for name, queryset in get_main_queries(activity.id, player_id, game_id).items():
+            plan = queryset.explain()
+            self.stdout.write(f"{name}:\n{plan}\n")
+            steps = find_unindexed_steps(plan)
+            if steps and name in UNINDEXED_QUERIES:
+                self.stdout.write(f"(Allowed without an index since {UNINDEXED_QUERIES[name]}.)\n")
+            elif steps:
+                unindexed.extend(f"{name}: {step}" for step in steps)
+        if unindexed:
+            message = "Queries that scan whole tables or sort without an index:\n" + "\n".join(unindexed)
+            if options["check"]:
+                raise CommandError(message)
+            self.stderr.write(message)
@@ -0,0 +1,48 @@
+"""Management command for exporting the full history of an activity."""
+
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from previous.export import CHUNK_SIZE, ENCODERS, EXPORTS, export_history
+from previous.models import Activity
+
+
+class Command(BaseCommand):
+    """Export all matches or the skill history of an activity as flat rows (see `previous.export`)."""
+
+    help = "Export all matches or the skill history of an activity as newline-delimited JSON or CSV."
+
+    def add_arguments(self, parser):
+        """Define command-line arguments."""
+        parser.add_argument("activity", help="URL of the activity to export.")
+        parser.add_argument("table", choices=list(EXPORTS), help="What to export.")
+        parser.add_argument("--format", choices=list(ENCODERS), default="ndjson", help="Format of the rows.")
+        parser.add_argument("--output", help="File to write to (defaults to standard output).")
+        parser.add_argument("--gzip", action="store_true", help="Compress the output with gzip.")
+        parser.add_argument(
+            "--chunk-size", type=int, default=CHUNK_SIZE, help=f"Rows read at a time (default: {CHUNK_SIZE})."
+        )
+
+    def handle(self, *args, **options):
+        """Run the export."""
+        activity = Activity.objects.filter(url=options["activity"]).first()
+        if activity is None:
+            raise CommandError(f"No such activity: {options['activity']}")
+
+        chunks = export_history(
+            options["table"],
+            activity.id,
+            options["format"],
+            compress=options["gzip"],
+            chunk_size=options["chunk_size"],
+        )
+        if options["output"] is None:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+        with open(options["output"], "wb") as file:
+            for chunk in chunks:
+                file.write(chunk)
+        self.stdout.write(f"Exported the {options['table']} of {activity.url} to {options['output']}")
@@ -0,0 +1,88 @@
+"""Management command for importing (historical) matches in bulk."""
+
+import gzip
+import sys
+import time
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from previous.importer import DECODERS, IMPORT_BATCH_SIZE, ImportStoppedError, import_matches
+from previous.jobs import enqueue_recalculations_from
+from previous.models import Activity
+from previous.ratings import recalculate_player_skills_from
+
+
+class Command(BaseCommand):
+    """Import matches from flat rows (see `previous.importer`) and then update the ratings once."""
+
+    help = "Import matches into an activity from newline-delimited JSON or CSV (e.g. as exported by export_history)."
+
+    def add_arguments(self, parser):
+        """Define command-line arguments."""
+        parser.add_argument("activity", help="URL of the activity to import into.")
+        parser.add_argument("input", help='File to import (compressed if it ends with ".gz"), or "-" for stdin.')
+        parser.add_argument(
+            "--format", choices=list(DECODERS), help='Format of the rows (default: "csv" for .csv files, or "ndjson").'
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=IMPORT_BATCH_SIZE,
+            help=f"Matches inserted per transaction (default: {IMPORT_BATCH_SIZE}).",
+        )
+        recalculation = parser.add_mutually_exclusive_group()
+        recalculation.add_argument(
+            "--queue", action="store_true", help="Queue the recalculation of ratings (instead of waiting for it)."
+        )
+        recalculation.add_argument("--no-recalculate", action="store_true", help="Don't recalculate ratings.")
+
+    def handle(self, *args, **options):
+        """Run the import."""
+        activity = Activity.objects.filter(url=options["activity"]).first()
+        if activity is None:
+            raise CommandError(f"No such activity: {options['activity']}")
+        path = options["input"]
+        file_format = options["format"] or ("csv" if path.removesuffix(".gz").endswith(".csv") else "ndjson")
+
+        start = time.time()
+
+        def report(rows: int, matches: int) -> None:
+            seconds = time.time() - start
+            self.stdout.write(f"Imported {matches} matches ({rows} rows, {rows / max(seconds, 1e-6):.0f} rows/s)")
+
+        if path == "-":
+            file = nullcontext(sys.stdin)
+        else:
+            # Closed by the `with` statement below
+            file = gzip.open(path, "rt", newline="") if path.endswith(".gz") else open(path, newline="")  # noqa: SIM115
+        try:
+            with file as lines:
+                result = import_matches(
+                    activity,
+                    DECODERS[file_format](lines),
+                    options["batch_size"],
+                    progress=report if options["verbosity"] > 1 else None,
+                )
+        except ImportStoppedError as e:
+            # Ratings are still updated for the batches that were imported
+            self.update_ratings(activity, e.result, options)
+            raise CommandError(f"Import stopped (earlier batches were imported): {e}") from e
+        seconds = time.time() - start
+        self.stdout.write(
+            f"Imported {result.matches} matches ({result.rows} rows) in {seconds:.2f}s"
+            f" ({result.rows / max(seconds, 1e-6):.0f} rows/s)"
+        )
+        self.update_ratings(activity, result, options)
+
+    def update_ratings(self, activity, result, options):
+        """Recalculate (or queue the recalculation of) ratings from the earliest validated match that was imported."""
+        if result.earliest_validated is None or options["no_recalculate"]:
+            return
+        if options["queue"]:
+            enqueue_recalculations_from({activity.id: result.earliest_validated})
+            self.stdout.write("Queued the recalculation of ratings")
+            return
+        start = time.time()
+        recalculate_player_skills_from(activity.id, result.earliest_validated)
+        self.stdout.write(f"Recalculated ratings from the earliest imported match in {time.time() - start:.2f}s")
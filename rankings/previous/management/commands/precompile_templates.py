@@ -0,0 +1,22 @@
+"""Management command for compiling all templates ahead of their first use."""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rankings.jinja2 import precompile_templates
+
+
+class Command(BaseCommand):
+    """Compile all Jinja templates into the bytecode cache (see `settings.JINJA2_BYTECODE_CACHE_DIR`)."""
+
+    help = "Compile all templates into the bytecode cache (e.g. after a deploy, before the site is started)."
+
+    def handle(self, *args, **options):
+        """Compile the templates."""
+        if not settings.JINJA2_BYTECODE_CACHE_DIR:
+            self.stderr.write("No bytecode cache is set (DJANGO_JINJA2_BYTECODE_CACHE_DIR): templates are only checked")
+        start = time.time()
+        names = precompile_templates()
+        self.stdout.write(f"Compiled {len(names)} templates in {time.time() - start:.2f}s")
@@ -0,0 +1,42 @@
+"""Management command for processing queued skill ranking recalculations."""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from previous.jobs import process_queued_jobs, requeue_stale_jobs
+
+
+class Command(BaseCommand):
+    """Worker that processes queued recalculation jobs (see `previous.jobs`)."""
+
+    help = "Process queued skill ranking recalculation jobs."
+
+    def add_arguments(self, parser):
+        """Define command-line arguments."""
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of waiting for new jobs.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=5.0,
+            help="Seconds to wait before checking an empty queue again (default: 5).",
+        )
+
+    def handle(self, *args, **options):
+        """Run the worker."""
+        # Jobs left running by a worker that stopped (e.g. crashed) would otherwise never finish
+        requeued = requeue_stale_jobs(settings.RECALCULATION_JOB_TIMEOUT)
+        if requeued > 0:
+            self.stdout.write(f"Queued {requeued} stale job(s) again")
+        while True:
+            count = process_queued_jobs()
+            if count > 0:
+                self.stdout.write(f"Processed {count} job(s)")
+            if options["once"]:
+                break
+            time.sleep(options["poll_interval"])
@@ -0,0 +1,28 @@
+"""Management command for fully recalculating the skill rankings of all activities."""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from previous.ratings import recalculate_all_activities
+
+
+class Command(BaseCommand):
+    """Recalculate all activities, with a chunk of sessions of a different activity replayed in each process."""
+
+    help = "Fully recalculate the skill rankings of all activities (in parallel)."
+
+    def add_arguments(self, parser):
+        """Define command-line arguments."""
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Number of processes to use (defaults to the number of CPUs).",
+        )
+
+    def handle(self, *args, **options):
+        """Run the recalculation."""
+        start = time.time()
+        count = recalculate_all_activities(options["workers"])
+        self.stdout.write(f"Recalculated {count} activities in {time.time() - start:.2f}s")
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.15 on 2026-10-18 12:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('previous', '0005_alter_activity_about_alter_activity_name_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecalculationJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('after_date', models.DateField(blank=True, null=True)),
+                ('status', models.TextField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued')),
+                ('games_total', models.IntegerField(default=0)),
+                ('games_processed', models.IntegerField(default=0)),
+                ('created', models.FloatField(blank=True, null=True)),
+                ('started', models.FloatField(blank=True, null=True)),
+                ('finished', models.FloatField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('activity', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='previous.activity')),
+            ],
+            options={
+                'db_table': 'recalculation_job',
+            },
+        ),
+    ]
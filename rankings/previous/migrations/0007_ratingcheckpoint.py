@@ -0,0 +1,32 @@
+# Generated by Django 4.2.15 on 2026-10-18 12:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('previous', '0006_recalculationjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recalculationjob',
+            name='from_datetime',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='RatingCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('datetime', models.IntegerField()),
+                ('ratings', models.BinaryField()),
+                ('activity', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='previous.activity')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='previous.gamesession')),
+            ],
+            options={
+                'db_table': 'rating_checkpoint',
+            },
+        ),
+    ]
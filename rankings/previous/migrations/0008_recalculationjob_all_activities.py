@@ -0,0 +1,19 @@
+# Generated by Django 4.2.15 on 2026-10-18 12:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('previous', '0007_ratingcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recalculationjob',
+            name='activity',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='previous.activity'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.15 on 2026-10-18 12:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_leaderboards(apps, schema_editor):
+    Ranking = apps.get_model("previous", "Ranking")
+    LeaderboardEntry = apps.get_model("previous", "LeaderboardEntry")
+    entries = []
+    ranked_per_activity = {}
+    for ranking in Ranking.objects.select_related("player").iterator():
+        skill = 0.0
+        if ranking.mu is not None and ranking.sigma is not None:
+            skill = max(0.0, min(ranking.mu - 3 * ranking.sigma, 50.0))
+        entry = LeaderboardEntry(
+            ranking_id=ranking.id, activity_id=ranking.activity_id, player_id=ranking.player_id, skill=skill
+        )
+        entries.append(entry)
+        if ranking.player.active and skill > 0:
+            ranked_per_activity.setdefault(ranking.activity_id, []).append(entry)
+    # Number the active players of each activity in order of skill (and player id)
+    for ranked in ranked_per_activity.values():
+        ranked.sort(key=lambda entry: (-entry.skill, entry.player_id))
+        for position, entry in enumerate(ranked, start=1):
+            entry.position = position
+    LeaderboardEntry.objects.bulk_create(entries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('previous', '0008_recalculationjob_all_activities'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('ranking', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='leaderboard', serialize=False, to='previous.ranking')),
+                ('skill', models.FloatField(default=0)),
+                ('position', models.IntegerField(blank=True, null=True)),
+                ('delta', models.FloatField(default=0)),
+                ('activity', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='previous.activity')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='previous.player')),
+            ],
+            options={
+                'db_table': 'leaderboard',
+                'indexes': [models.Index(fields=['activity', '-skill'], name='leaderboard_activity_skill')],
+            },
+        ),
+        migrations.RunPython(populate_leaderboards, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.15 on 2026-10-18 12:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('previous', '0009_leaderboardentry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['session', 'datetime', 'position'], name='game_session_order'),
+        ),
+        migrations.AddIndex(
+            model_name='gamesession',
+            index=models.Index(fields=['activity', 'validated', 'datetime'], name='gamesession_activity_validated'),
+        ),
+        migrations.AddIndex(
+            model_name='gamesession',
+            index=models.Index(condition=models.Q(('validated__isnull', True)), fields=['activity', 'datetime'], name='gamesession_pending'),
+        ),
+        migrations.AddIndex(
+            model_name='ratingcheckpoint',
+            index=models.Index(fields=['activity', 'datetime', 'session'], name='rating_checkpoint_order'),
+        ),
+        migrations.AddIndex(
+            model_name='result',
+            index=models.Index(fields=['game', 'team'], name='result_game_team'),
+        ),
+        migrations.AddIndex(
+            model_name='result',
+            index=models.Index(fields=['game', 'ranking'], name='result_game_ranking'),
+        ),
+        migrations.AddIndex(
+            model_name='skillhistory',
+            index=models.Index(fields=['player', 'activity', 'result'], name='skill_history_player_activity'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.15 on 2026-10-18 12:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('previous', '0010_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='gamesession',
+            index=models.Index(fields=['activity', 'datetime'], name='gamesession_activity_datetime'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.15 on 2026-10-18 12:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('previous', '0011_session_order_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('activity', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='data_version', serialize=False, to='previous.activity')),
+                ('version', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'data_version',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.15 on 2026-10-18 13:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('previous', '0012_dataversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataversion',
+            name='modified',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
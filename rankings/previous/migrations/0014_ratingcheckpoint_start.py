@@ -0,0 +1,18 @@
+# Generated by Django 4.2.15 on 2026-10-18 13:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('previous', '0013_dataversion_modified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ratingcheckpoint',
+            name='start',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
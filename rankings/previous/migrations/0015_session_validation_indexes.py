@@ -0,0 +1,29 @@
+# Generated by Django 4.2.15 on 2026-10-18 13:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('previous', '0014_ratingcheckpoint_start'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='gamesession',
+            name='gamesession_activity_validated',
+        ),
+        migrations.RemoveIndex(
+            model_name='gamesession',
+            name='gamesession_pending',
+        ),
+        migrations.AddIndex(
+            model_name='gamesession',
+            index=models.Index(condition=models.Q(('validated__isnull', False)), fields=['activity', 'validated', 'datetime'], name='gamesession_activity_validated'),
+        ),
+        migrations.AddIndex(
+            model_name='gamesession',
+            index=models.Index(condition=models.Q(('validated__isnull', True)), fields=['activity', 'validated', 'datetime'], name='gamesession_pending'),
+        ),
+    ]
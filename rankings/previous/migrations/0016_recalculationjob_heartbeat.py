@@ -0,0 +1,18 @@
+# Generated by Django 4.2.15 on 2026-10-18 14:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('previous', '0015_session_validation_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recalculationjob',
+            name='heartbeat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
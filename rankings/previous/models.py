@@ -14,13 +14,34 @@ Originally generated with `inspectdb`.
 from __future__ import unicode_literals
 
 import datetime
-from typing import Any
+from collections import defaultdict
+from typing import Any, Iterable, Optional
 
 from django.db import models
 
 from .utils import cardinal_to_ordinal
 
 
+def calc_skill(mu: Optional[float], sigma: Optional[float]) -> float:
+    """Calculate ranking/skill value from skill probability."""
+    min_range = 0  # TODO: skill_type.min_skill_range
+    max_range = 50  # skill_type.max_skill_range
+
+    if mu is None or sigma is None:
+        return min_range
+    skill: float = max(min_range, min(mu - 3 * sigma, max_range))
+    return skill
+
+
+def join_names(names: list[str]) -> str:
+    """Join names into a text summary, e.g. "A, B & C"."""
+    if len(names) == 0:
+        return ""
+    if len(names) == 1:
+        return names[0]
+    return ", ".join(names[:-1]) + " & " + names[-1]
+
+
 class Activity(models.Model):
     """A type of activity/game for which new match results can be recorded."""
 
@@ -42,8 +63,9 @@ class Activity(models.Model):
         return self.name
 
     def to_dict_with_url(self):
-        """Convert whole object to a dictionary."""
-        result = self.__dict__
+        """Convert whole object to a (new) dictionary."""
+        # A copy, since templates modify it (and activities are shared by requests, see `registry`)
+        result = {key: value for key, value in self.__dict__.items() if key != "_state"}
         # TODO: no longer "with_url"
         # result["url"] = result["id"]
         return result
@@ -73,6 +95,22 @@ class GameSession(SubmittedData):
 
     class Meta:
         db_table = "gamesession"
+        indexes = [
+            # Validated or invalidated sessions (pending ones use the index below)
+            models.Index(
+                fields=["activity", "validated", "datetime"],
+                name="gamesession_activity_validated",
+                condition=models.Q(validated__isnull=False),
+            ),
+            # All sessions in order (e.g. for keyset pagination)
+            models.Index(fields=["activity", "datetime"], name="gamesession_activity_datetime"),
+            # Pending sessions (awaiting validation), including the (null) validated field so that the index covers them
+            models.Index(
+                fields=["activity", "validated", "datetime"],
+                name="gamesession_pending",
+                condition=models.Q(validated__isnull=True),
+            ),
+        ]
 
     def __str__(self):
         return f"Game of {self.activity} @ {self.datetime} (Submitter: {self.submittor})"
@@ -105,12 +143,7 @@ class AdhocTeam(models.Model):
 
     def members_str(self):
         """Generate a text summary of players in team."""
-        members = [str(m.player) for m in TeamMember.objects.filter(team=self)]
-        if len(members) == 0:
-            return ""
-        if len(members) == 1:
-            return members[0]
-        return ", ".join(members[:-1]) + " & " + members[-1]
+        return join_names([str(m.player) for m in TeamMember.objects.filter(team=self)])
 
 
 class Game(SubmittedData):
@@ -119,6 +152,12 @@ class Game(SubmittedData):
     session = models.ForeignKey(GameSession, models.DO_NOTHING)
     position = models.IntegerField(default=0)
 
+    # Order of lists of games (newest first): by session, as read from the session indexes, and then by game
+    NEWEST_FIRST = ("-session__datetime", "-session_id", "-id")
+
+    class Meta:
+        indexes = [models.Index(fields=["session", "datetime", "position"], name="game_session_order")]
+
     def __str__(self):
         return f"Game of {self.session.activity} @ {self.session.datetime} (Submitter: {self.session.submittor})"
 
@@ -138,17 +177,55 @@ class Game(SubmittedData):
 
     def to_dict_with_teams(self) -> dict[str, Any]:
         """Get game as well as team details as a dict."""
-        result = self.__dict__
-        # TODO: use UTC?
-        result["relative_date"] = datetime.datetime.fromtimestamp(self.datetime).astimezone()
-        result["date"] = datetime.datetime.fromtimestamp(self.datetime).astimezone()
-        teams = AdhocTeam.objects.filter(session=self.session)
-        for idx, team in enumerate(teams):
-            result[f"team{idx + 1}"] = team.members_str()
-            team_result = Result.objects.get(game=self, team=team)
-            result[f"team{idx + 1}_rank"] = team_result.ranking
-
-        return result
+        return Game.to_dicts_with_teams([self])[0]
+
+    @staticmethod
+    def to_dicts_with_teams(
+        games: Iterable["Game"], sessions: Optional[Iterable[GameSession]] = None
+    ) -> list[dict[str, Any]]:
+        """Get a list of games as well as their team details as dicts (see `to_dict_with_teams`).
+
+        Only a fixed number of queries are used, regardless of the number of games. If the sessions of the games are
+        given with their teams and members already loaded (see `dashboard.prefetch_match_details`), those are used.
+        """
+        games = list(games)
+        session_ids = {game.session_id for game in games}
+        teams_per_session: dict[int, list[int]] = defaultdict(list)
+        members_per_team: dict[int, list[str]] = defaultdict(list)
+        if sessions is not None:
+            for session in sessions:
+                for team in session.adhocteam_set.all():
+                    teams_per_session[session.id].append(team.id)
+                    members_per_team[team.id].extend(member.player.name for member in team.teammember_set.all())
+        else:
+            for team_id, session_id in (
+                AdhocTeam.objects.filter(session_id__in=session_ids).order_by("id").values_list("id", "session_id")
+            ):
+                teams_per_session[session_id].append(team_id)
+            for team_id, name in (
+                TeamMember.objects.filter(team__session_id__in=session_ids)
+                .order_by("id")
+                .values_list("team_id", "player__name")
+            ):
+                members_per_team[team_id].append(name)
+        rankings = {
+            (game_id, team_id): ranking
+            for game_id, team_id, ranking in Result.objects.filter(game__in=[game.id for game in games]).values_list(
+                "game_id", "team_id", "ranking"
+            )
+        }
+
+        summaries = []
+        for game in games:
+            result = game.__dict__
+            # TODO: use UTC?
+            result["relative_date"] = datetime.datetime.fromtimestamp(game.datetime).astimezone()
+            result["date"] = datetime.datetime.fromtimestamp(game.datetime).astimezone()
+            for idx, team_id in enumerate(teams_per_session[game.session_id]):
+                result[f"team{idx + 1}"] = join_names(members_per_team[team_id])
+                result[f"team{idx + 1}_rank"] = rankings.get((game.id, team_id))
+            summaries.append(result)
+        return summaries
 
 
 class Result(SubmittedData):
@@ -158,10 +235,22 @@ class Result(SubmittedData):
     team = models.ForeignKey(AdhocTeam, models.DO_NOTHING, related_name="+")
     ranking = models.IntegerField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["game", "team"], name="result_game_team"),
+            models.Index(fields=["game", "ranking"], name="result_game_ranking"),
+        ]
+
     def __str__(self):
         return f"{self.team} ranked {self.ranking} @ ({self.game})"
 
 
+def annotate_winning_team(games: "models.QuerySet[Game]") -> "models.QuerySet[Game]":
+    """Annotate games with the ID of the team with rank of 1 (as `winning_team_id`)."""
+    winners = Result.objects.filter(game=models.OuterRef("pk"), ranking=1).order_by("id").values("team_id")[:1]
+    return games.annotate(winning_team_id=models.Subquery(winners))
+
+
 class Player(models.Model):
     """A person who forms part of teams to play in games."""
 
@@ -208,13 +297,40 @@ class Ranking(models.Model):
 
     def calc_skill(self) -> float:
         """Calculate ranking/skill value from skill probability."""
-        min_range = 0  # TODO: skill_type.min_skill_range
-        max_range = 50  # skill_type.max_skill_range
+        return calc_skill(self.mu, self.sigma)
+
+
+class LeaderboardEntry(models.Model):
+    """A player's precalculated skill and position on the leaderboard of an activity (derived from their Ranking).
+
+    Refreshed by the rating engine whenever rankings change, so that leaderboards can be sorted and paged by index.
+    """
+
+    ranking = models.OneToOneField(Ranking, models.CASCADE, primary_key=True, related_name="leaderboard")
+    activity = models.ForeignKey(Activity, models.DO_NOTHING)
+    player = models.ForeignKey(Player, models.DO_NOTHING)
+    skill = models.FloatField(default=0)
+    # Position (starting at 1) amongst active players with a skill above 0, otherwise null
+    position = models.IntegerField(blank=True, null=True)
+    # Change in skill due to the player's last match
+    delta = models.FloatField(default=0)
+
+    class Meta:
+        db_table = "leaderboard"
+        indexes = [models.Index(fields=["activity", "-skill"], name="leaderboard_activity_skill")]
 
-        if self.mu is None or self.sigma is None:
-            return min_range
-        skill: float = max(min_range, min(self.mu - 3 * self.sigma, max_range))
-        return skill
+    def __str__(self) -> str:
+        return f"#{self.position} {self.player_id} @ {self.activity_id}: {self.skill}"
+
+    def to_dict_with_player(self) -> dict[str, Any]:
+        """Get the entry and the player's details as a dict (like `Player.to_dict_with_skill`)."""
+        return {
+            "id": self.player_id,
+            "name": self.player.name,
+            "skill": self.skill,
+            "position": self.position,
+            "delta": self.delta,
+        }
 
 
 class SkillHistory(models.Model):
@@ -229,17 +345,14 @@ class SkillHistory(models.Model):
     class Meta:
         db_table = "skill_history"
         unique_together = (("player", "result"),)
+        indexes = [models.Index(fields=["player", "activity", "result"], name="skill_history_player_activity")]
 
     def __str__(self):
         return f"[Game {self.result.game.id}] {self.player} @ {self.activity}: ({self.mu}, {self.sigma})"
 
     def calc_skill(self):
         """Calculate ranking/skill value from skill probability."""
-        min_range = 0  # TODO: skill_type.min_skill_range
-        max_range = 50  # skill_type.max_skill_range
-
-        skill = max(min_range, min(self.mu - 3 * self.sigma, max_range))
-        return skill
+        return calc_skill(self.mu, self.sigma)
 
 
 class SkillType(models.Model):
@@ -279,3 +392,96 @@ class TeamMember(models.Model):
 
     def __str__(self):
         return f"{self.player} was member of {self.team}"
+
+
+class RecalculationJob(models.Model):
+    """A queued request to recalculate the skill rankings of an activity (see the `rankings_worker` command)."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [(QUEUED, "Queued"), (RUNNING, "Running"), (DONE, "Done"), (FAILED, "Failed")]
+
+    # All activities are recalculated if not set
+    activity = models.ForeignKey(Activity, models.DO_NOTHING, blank=True, null=True)
+    # Only consider games after this date (all games are considered if not set)
+    after_date = models.DateField(blank=True, null=True)
+    # Only recalculate from the closest checkpoint before this (unix) time, e.g. due to a change in an old match
+    from_datetime = models.IntegerField(blank=True, null=True)
+    status = models.TextField(choices=STATUS_CHOICES, default=QUEUED)
+    games_total = models.IntegerField(default=0)
+    games_processed = models.IntegerField(default=0)
+    # Unix timestamps (with fractional seconds)
+    created = models.FloatField(blank=True, null=True)
+    started = models.FloatField(blank=True, null=True)
+    finished = models.FloatField(blank=True, null=True)
+    # Last time that the worker running the job was known to be alive (updated with its progress)
+    heartbeat = models.FloatField(blank=True, null=True)
+    error = models.TextField(blank=True, default="")
+
+    class Meta:
+        db_table = "recalculation_job"
+
+    def __str__(self):
+        return f"Job {self.id}: recalculate {self.activity_id or 'all activities'} ({self.status})"
+
+    def to_status_dict(self, now: float) -> dict[str, Any]:
+        """Summarise the job's progress as a dict."""
+        elapsed = None
+        if self.started is not None:
+            elapsed = (self.finished or now) - self.started
+        return {
+            "id": self.id,
+            "activity": self.activity_id,
+            "after_date": self.after_date.isoformat() if self.after_date is not None else None,
+            "from_datetime": self.from_datetime,
+            "status": self.status,
+            "games_processed": self.games_processed,
+            "games_total": self.games_total,
+            "elapsed": elapsed,
+            "duration": elapsed if self.finished is not None else None,
+            "error": self.error,
+        }
+
+
+class RatingCheckpoint(models.Model):
+    """A snapshot of the ratings of all players in an activity directly after a given session's results.
+
+    Allows recalculations to restart from the closest checkpoint instead of replaying the whole history.
+    """
+
+    activity = models.ForeignKey(Activity, models.DO_NOTHING)
+    # The last session included in the snapshot (and its datetime since sessions are processed in that order)
+    session = models.ForeignKey(GameSession, models.DO_NOTHING)
+    datetime = models.IntegerField()
+    # Packed (player id, mu, sigma) values
+    ratings = models.BinaryField()
+    # Unix time from which matches were included in the ratings (e.g. after a recalculation from a certain date), or
+    # null if all matches were included
+    start = models.IntegerField(blank=True, null=True)
+
+    class Meta:
+        db_table = "rating_checkpoint"
+        indexes = [models.Index(fields=["activity", "datetime", "session"], name="rating_checkpoint_order")]
+
+    def __str__(self):
+        return f"Checkpoint of {self.activity_id} @ {self.datetime} (Session: {self.session_id})"
+
+
+class DataVersion(models.Model):
+    """Version of the data of an activity, which is increased whenever its matches or rankings change.
+
+    Responses are cached per version (see `cache`), so that they're reused until the data changes.
+    """
+
+    activity = models.OneToOneField(Activity, models.CASCADE, primary_key=True, related_name="data_version")
+    version = models.IntegerField(default=0)
+    # When the version was last increased
+    modified = models.IntegerField(blank=True, null=True)
+
+    class Meta:
+        db_table = "data_version"
+
+    def __str__(self):
+        return f"Data of {self.activity_id} (version {self.version})"
@@ -0,0 +1,801 @@
+"""Rating (skill) calculation engine.
+
+All the details needed to (re)calculate ratings are loaded with a constant number of queries, the games are then
+replayed in memory and the results are written back to the database in bulk. Recalculations load, replay and save the
+sessions a chunk at a time (see `SessionReplay`), so that their memory use doesn't depend on the number of sessions and
+the database is only locked for one chunk at a time.
+"""
+
+import itertools
+import logging
+import os
+import struct
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, cast
+
+import django
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Q, QuerySet
+from trueskill import Rating, global_env, rate
+
+from . import kernel
+from .cache import bump_data_versions
+from .models import (
+    Activity,
+    AdhocTeam,
+    Game,
+    GameSession,
+    LeaderboardEntry,
+    Player,
+    Ranking,
+    RatingCheckpoint,
+    Result,
+    SkillHistory,
+    TeamMember,
+    calc_skill,
+)
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of rows to write per query when doing bulk inserts and updates.
+BULK_BATCH_SIZE = 500
+# Number of games to process between each report of progress.
+PROGRESS_INTERVAL = 100
+# Maximum number of seconds between reports of progress while waiting for other processes.
+PROGRESS_WAIT_TIMEOUT = 10.0
+
+# Callback that receives the number of games processed so far and the total number of games to process.
+ProgressCallback = Callable[[int, int], None]
+
+# Binary format of each player's rating in a checkpoint: (player id, mu, sigma).
+CHECKPOINT_ENTRY = struct.Struct("<qdd")
+
+
+class GameRecord(NamedTuple):
+    """A single game with all the details needed to update the ratings of the players involved."""
+
+    session_id: int
+    # Datetime of the session (which determines the order in which games are processed).
+    datetime: int
+    game_id: int
+    # Player ids of each team.
+    teams: List[List[int]]
+    # Result id and ranking of each team (in the same order as `teams`).
+    result_ids: List[int]
+    ranks: List[int]
+
+
+class HistoryEntry(NamedTuple):
+    """A player's rating directly after a given game's result (see SkillHistory)."""
+
+    result_id: int
+    player_id: int
+    mu: float
+    sigma: float
+
+
+def new_rating(activity: Activity) -> Rating:
+    """Generate a starting ranking for the given activity."""
+    # TODO: use activity.skill_ranking
+    start_mu = 25
+    start_sigma = 25 / 3.0
+    return Rating(start_mu, start_sigma)
+
+
+def generate_blank_ratings(activity: Activity) -> Dict[int, Rating]:
+    """Generate an empty dictionary of rankings for all currently known players."""
+    ratings = {player_id: new_rating(activity) for player_id in Player.objects.values_list("id", flat=True)}
+    return ratings
+
+
+def load_games(sessions: "QuerySet[GameSession]") -> List[GameRecord]:
+    """Load all the games of the given sessions in the (chronological) order in which they should be processed.
+
+    Only a fixed number of queries are used, regardless of the number of sessions.
+    """
+    session_ids = sessions.order_by().values("id")
+
+    teams_per_session: Dict[int, List[int]] = defaultdict(list)
+    for team_id, session_id in (
+        AdhocTeam.objects.filter(session__in=session_ids).order_by("id").values_list("id", "session_id")
+    ):
+        teams_per_session[session_id].append(team_id)
+
+    members_per_team: Dict[int, List[int]] = defaultdict(list)
+    for team_id, player_id in (
+        TeamMember.objects.filter(team__session__in=session_ids).order_by("id").values_list("team_id", "player_id")
+    ):
+        members_per_team[team_id].append(player_id)
+
+    results: Dict[Tuple[int, int], Tuple[int, int]] = {
+        (game_id, team_id): (result_id, ranking)
+        for result_id, game_id, team_id, ranking in Result.objects.filter(game__session__in=session_ids).values_list(
+            "id", "game_id", "team_id", "ranking"
+        )
+    }
+
+    games = []
+    for game_id, session_id, session_datetime in (
+        Game.objects.filter(session__in=session_ids)
+        .order_by("session__datetime", "session_id", "datetime", "position", "id")
+        .values_list("id", "session_id", "session__datetime")
+    ):
+        team_ids = teams_per_session[session_id]
+        game_results = [results[(game_id, team_id)] for team_id in team_ids]
+        games.append(
+            GameRecord(
+                session_id=session_id,
+                datetime=session_datetime,
+                game_id=game_id,
+                teams=[members_per_team[team_id] for team_id in team_ids],
+                result_ids=[result_id for result_id, _ in game_results],
+                ranks=[ranking for _, ranking in game_results],
+            )
+        )
+    return games
+
+
+def pack_ratings(ratings: Dict[int, Rating]) -> bytes:
+    """Pack the ratings of players into a compact binary format (see RatingCheckpoint)."""
+    return b"".join(CHECKPOINT_ENTRY.pack(player_id, rating.mu, rating.sigma) for player_id, rating in ratings.items())
+
+
+def unpack_ratings(data: bytes) -> Dict[int, Rating]:
+    """Unpack ratings of players that were packed with `pack_ratings`."""
+    return {player_id: Rating(mu, sigma) for player_id, mu, sigma in CHECKPOINT_ENTRY.iter_unpack(data)}
+
+
+class CheckpointRecorder:
+    """Records a snapshot of the ratings every time a certain number of sessions have been replayed."""
+
+    def __init__(self, interval: int, sessions_since_checkpoint: int = 0, start: Optional[int] = None):
+        self.interval = interval
+        self.sessions_since_checkpoint = sessions_since_checkpoint
+        # Time from which matches are included in the ratings (see `RatingCheckpoint.start`)
+        self.start = start
+        # The last session included in each snapshot, its datetime and the packed ratings.
+        self.snapshots: List[Tuple[int, int, bytes]] = []
+
+    def is_snapshot_due(self) -> bool:
+        """Check if a snapshot will be recorded when the current session is completed."""
+        return self.interval > 0 and self.sessions_since_checkpoint + 1 >= self.interval
+
+    def session_completed(self, game: GameRecord, ratings: Dict[int, Rating]) -> None:
+        """Record that all games of a session have been replayed."""
+        if self.is_snapshot_due():
+            self.snapshots.append((game.session_id, game.datetime, pack_ratings(ratings)))
+            self.sessions_since_checkpoint = 0
+            return
+        self.sessions_since_checkpoint += 1
+
+
+def use_fast_kernel() -> bool:
+    """Check if the vectorised (NumPy) rating kernel should be used (see `previous.kernel`)."""
+    if settings.RATING_KERNEL != "numpy":
+        return False
+    if not kernel.is_available():
+        logger.warning("NumPy is not installed: falling back to the default rating kernel")
+        return False
+    return True
+
+
+class Replay:
+    """Replays games one after the other to update the ratings of all the players involved."""
+
+    def __init__(
+        self,
+        ratings: Dict[int, Rating],
+        checkpoints: Optional[CheckpointRecorder] = None,
+        fast_kernel: Optional[bool] = None,
+    ):
+        self.ratings = ratings
+        self.checkpoints = checkpoints
+        self.history: List[HistoryEntry] = []
+        self.previous_game: Optional[GameRecord] = None
+        if fast_kernel is None:
+            fast_kernel = use_fast_kernel()
+        # Consecutive two-team games without any players in common can be rated together
+        self.batch = kernel.TwoTeamBatch(global_env()) if fast_kernel else None
+
+    def record(self, game: GameRecord, team_ratings: List[List[Rating]]) -> None:
+        """Record the new ratings of each player after a game."""
+        for team, result_id, new_ratings in zip(game.teams, game.result_ids, team_ratings):
+            for player_id, rating in zip(team, new_ratings):
+                self.ratings[player_id] = rating
+                self.history.append(HistoryEntry(result_id, player_id, rating.mu, rating.sigma))
+
+    def flush_batch(self) -> None:
+        """Rate all the games that are waiting in the current batch."""
+        if self.batch is not None and len(self.batch) > 0:
+            for game, team_ratings in self.batch.rate(self.ratings):
+                self.record(cast(GameRecord, game), team_ratings)
+
+    def session_completed(self, game: GameRecord) -> None:
+        """Handle all games of the session of the given game having been played."""
+        if self.checkpoints is None:
+            return
+        if self.checkpoints.is_snapshot_due():
+            self.flush_batch()
+        self.checkpoints.session_completed(game, self.ratings)
+
+    def play(self, game: GameRecord) -> None:
+        """Update ratings with the result of the next game."""
+        if self.previous_game is not None and game.session_id != self.previous_game.session_id:
+            self.session_completed(self.previous_game)
+        self.previous_game = game
+
+        if self.batch is not None and kernel.is_supported(game.teams, game.ranks):
+            if self.batch.conflicts(game.teams):
+                self.flush_batch()
+            self.batch.add(game, game.teams, game.ranks)
+            return
+        self.flush_batch()
+        team_ratings = rate([[self.ratings[player_id] for player_id in team] for team in game.teams], ranks=game.ranks)
+        self.record(game, team_ratings)
+
+    def finish(self) -> None:
+        """Finish updating ratings once all games have been played."""
+        self.flush_batch()
+        if self.previous_game is not None:
+            self.session_completed(self.previous_game)
+
+
+def replay_games(
+    games: List[GameRecord],
+    ratings: Dict[int, Rating],
+    progress: Optional[ProgressCallback] = None,
+    checkpoints: Optional[CheckpointRecorder] = None,
+    fast_kernel: Optional[bool] = None,
+) -> List[HistoryEntry]:
+    """Process each game (in the given order) to update the ratings of all the players involved.
+
+    The given ratings are updated in-place and the ratings after each game's result are returned.
+    """
+    replay = Replay(ratings, checkpoints, fast_kernel)
+    for idx, game in enumerate(games):
+        if progress is not None and idx % PROGRESS_INTERVAL == 0:
+            progress(idx, len(games))
+        replay.play(game)
+    replay.finish()
+    if progress is not None:
+        progress(len(games), len(games))
+    return replay.history
+
+
+def batched(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """Split an iterable into lists of (at most) the given size."""
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def save_skill_history(activity_id: str, history: Iterable[HistoryEntry]) -> None:
+    """Write the given skill history to the database (in batches)."""
+    for batch in batched(history, BULK_BATCH_SIZE):
+        SkillHistory.objects.bulk_create(
+            SkillHistory(
+                activity_id=activity_id,
+                result_id=entry.result_id,
+                player_id=entry.player_id,
+                mu=entry.mu,
+                sigma=entry.sigma,
+            )
+            for entry in batch
+        )
+
+
+def iter_session_chunks(sessions: "QuerySet[GameSession]", size: int) -> Iterator[List[int]]:
+    """Split sessions into chunks (of their IDs) in the (chronological) order in which they're processed."""
+    ordered = sessions.order_by("datetime", "id").values_list("id", "datetime")
+    chunk = list(ordered[:size])
+    while chunk:
+        yield [session_id for session_id, _ in chunk]
+        last_id, last_datetime = chunk[-1]
+        chunk = list(ordered.filter(Q(datetime__gt=last_datetime) | Q(datetime=last_datetime, id__gt=last_id))[:size])
+
+
+class ReplayedChunk(NamedTuple):
+    """The results of replaying a chunk of sessions (see `replay_chunk`)."""
+
+    ratings: Dict[int, Rating]
+    history: List[HistoryEntry]
+    checkpoints: CheckpointRecorder
+    # Change in skill of each player in the chunk due to their last match
+    deltas: Dict[int, float]
+
+
+def replay_chunk(
+    games: List[GameRecord],
+    ratings: Dict[int, Rating],
+    checkpoints: CheckpointRecorder,
+    fast_kernel: bool,  # noqa: FBT001
+    progress: Optional[ProgressCallback] = None,
+) -> ReplayedChunk:
+    """Replay the games of a chunk of (whole) sessions, continuing from the given ratings and checkpoints.
+
+    Doesn't access the database or settings, so that it can also be run in other processes.
+    """
+    ratings_before = dict(ratings)
+    history = replay_games(games, ratings, progress, checkpoints, fast_kernel)
+    return ReplayedChunk(ratings, history, checkpoints, last_match_deltas(history, ratings_before))
+
+
+class SessionReplay:
+    """Replays sessions of an activity a chunk of sessions at a time (of `RATING_REPLAY_CHUNK_SIZE` sessions).
+
+    Only the games, skill history and snapshots of one chunk are kept in memory. The skill history and checkpoints of
+    each chunk are saved in a transaction of their own, so that other writers only wait for one chunk at a time, and the
+    rankings and leaderboard are only replaced once all the chunks have been replayed (see `finish`).
+    """
+
+    def __init__(
+        self,
+        activity_id: str,
+        sessions: "QuerySet[GameSession]",
+        ratings: Dict[int, Rating],
+        checkpoints: CheckpointRecorder,
+        deltas: Optional[Dict[int, float]] = None,
+    ):
+        self.activity_id = activity_id
+        self.sessions = sessions
+        self.ratings = ratings
+        self.checkpoints = checkpoints
+        # Change in skill of each player due to their last match replayed so far (or since before the replay)
+        self.deltas = {} if deltas is None else deltas
+        self.fast_kernel = use_fast_kernel()
+        self.chunks = iter_session_chunks(sessions, settings.RATING_REPLAY_CHUNK_SIZE)
+
+    def count_games(self) -> int:
+        """Count the games that will be replayed."""
+        return Game.objects.filter(session__in=self.sessions.order_by().values("id")).count()
+
+    def next_chunk(self) -> Optional[List[GameRecord]]:
+        """Load the games of the next chunk of sessions (None once all of them have been loaded)."""
+        session_ids = next(self.chunks, None)
+        if session_ids is None:
+            return None
+        return load_games(GameSession.objects.filter(id__in=session_ids))
+
+    def save_chunk(self, chunk: ReplayedChunk) -> None:
+        """Save the skill history and checkpoints of a replayed chunk, and continue from its ratings."""
+        with transaction.atomic():
+            save_skill_history(self.activity_id, chunk.history)
+            save_checkpoints(self.activity_id, chunk.checkpoints)
+        chunk.checkpoints.snapshots.clear()
+        self.ratings = chunk.ratings
+        self.checkpoints = chunk.checkpoints
+        self.deltas.update(chunk.deltas)
+
+    def finish(self) -> None:
+        """Save the rankings of all the players and update the leaderboard once all chunks have been replayed."""
+        with transaction.atomic():
+            save_rankings(self.activity_id, self.ratings)
+            refresh_leaderboard(self.activity_id, self.deltas)
+
+    def run(self, progress: Optional[ProgressCallback] = None) -> None:
+        """Replay and save all the chunks (in this process), then finish.
+
+        Progress is reported outside of the transactions (as games are replayed and after each chunk is saved).
+        """
+        total_games = self.count_games() if progress is not None else 0
+        processed_games = 0
+        while (games := self.next_chunk()) is not None:
+            chunk_progress = None
+            if progress is not None:
+
+                def chunk_progress(processed: int, _total: int, offset: int = processed_games) -> None:
+                    progress(offset + processed, total_games)
+
+            self.save_chunk(replay_chunk(games, self.ratings, self.checkpoints, self.fast_kernel, chunk_progress))
+            processed_games += len(games)
+            if progress is not None:
+                # Reported once the chunk is saved (outside of its transaction)
+                progress(processed_games, total_games)
+        self.finish()
+
+
+def save_rankings(activity_id: str, ratings: Dict[int, Rating]) -> None:
+    """Create or update the current rankings of the given players."""
+    rankings = Ranking.objects.filter(activity_id=activity_id)
+    if len(ratings) <= BULK_BATCH_SIZE:
+        # Avoid loading all rankings when only a few players are being updated.
+        rankings = rankings.filter(player_id__in=ratings.keys())
+    existing = {ranking.player_id: ranking for ranking in rankings}
+    to_update = []
+    to_create = []
+    for player_id, rating in ratings.items():
+        ranking = existing.get(player_id)
+        if ranking is None:
+            to_create.append(Ranking(activity_id=activity_id, player_id=player_id, mu=rating.mu, sigma=rating.sigma))
+            continue
+        ranking.mu = rating.mu
+        ranking.sigma = rating.sigma
+        to_update.append(ranking)
+    Ranking.objects.bulk_update(to_update, ["mu", "sigma"], batch_size=BULK_BATCH_SIZE)
+    Ranking.objects.bulk_create(to_create, batch_size=BULK_BATCH_SIZE)
+
+
+def last_match_deltas(history: Iterable[HistoryEntry], ratings_before: Dict[int, Rating]) -> Dict[int, float]:
+    """Calculate the change in skill of each player (in the given history) due to their last match."""
+    skills: Dict[int, float] = {}
+    deltas: Dict[int, float] = {}
+    for entry in history:
+        previous = skills.get(entry.player_id)
+        if previous is None:
+            rating = ratings_before[entry.player_id]
+            previous = calc_skill(rating.mu, rating.sigma)
+        skills[entry.player_id] = calc_skill(entry.mu, entry.sigma)
+        deltas[entry.player_id] = skills[entry.player_id] - previous
+    return deltas
+
+
+def refresh_leaderboard(
+    activity_id: str, deltas: Optional[Dict[int, float]] = None, player_ids: Optional[Iterable[int]] = None
+) -> None:
+    """Update the leaderboard of an activity from its current rankings (see LeaderboardEntry).
+
+    Only the entries of the given players are updated (or all if not given), along with the positions that they affect.
+    The delta of each player is replaced if given, otherwise the last one is kept. The cached responses of the activity
+    are expired.
+    """
+    if deltas is None:
+        deltas = {}
+    rankings = Ranking.objects.filter(activity_id=activity_id)
+    entries = LeaderboardEntry.objects.filter(activity_id=activity_id)
+    if player_ids is not None:
+        player_ids = list(player_ids)
+        rankings = rankings.filter(player_id__in=player_ids)
+        entries = entries.filter(player_id__in=player_ids)
+    existing = {entry.ranking_id: entry for entry in entries}
+    to_update = []
+    to_create = []
+    # Skill before the change of each changed entry (None if it wasn't ranked)
+    previous_skills: Dict[int, Optional[float]] = {}
+    for ranking_id, player_id, mu, sigma in rankings.values_list("id", "player_id", "mu", "sigma"):
+        entry = existing.get(ranking_id)
+        if entry is None:
+            entry = LeaderboardEntry(ranking_id=ranking_id, activity_id=activity_id, player_id=player_id)
+            to_create.append(entry)
+            previous_skills[ranking_id] = None
+        elif (entry.skill, entry.delta) != (calc_skill(mu, sigma), deltas.get(player_id, entry.delta)):
+            to_update.append(entry)
+            previous_skills[ranking_id] = entry.skill if entry.position is not None else None
+        entry.skill = calc_skill(mu, sigma)
+        entry.delta = deltas.get(player_id, entry.delta)
+    LeaderboardEntry.objects.bulk_update(to_update, ["skill", "delta"], batch_size=BULK_BATCH_SIZE)
+    LeaderboardEntry.objects.bulk_create(to_create, batch_size=BULK_BATCH_SIZE)
+    update_leaderboard_positions(activity_id, None if player_ids is None else previous_skills)
+    bump_data_versions([activity_id])
+
+
+def update_leaderboard_positions(
+    activity_id: str, previous_skills: Optional[Dict[int, Optional[float]]] = None
+) -> None:
+    """Assign positions to the active players with a skill above 0 in order of their skill (others have none).
+
+    If only some entries changed, `previous_skills` has the skill of each of them (by ranking id) before the change
+    (None if it wasn't ranked). Then only the positions between the lowest and highest of their skills (before and
+    after the change) are recalculated, while the positions below those are shifted by the change in the number of
+    ranked players between them. Only the entries whose position changed are written.
+    """
+    entries = LeaderboardEntry.objects.filter(activity_id=activity_id)
+    ranked = entries.filter(skill__gt=0, player__active=True)
+    first_position = 1
+    if previous_skills is None:
+        in_range = ranked
+        entries.filter(position__isnull=False).exclude(ranking_id__in=ranked.values("ranking_id")).update(position=None)
+    else:
+        current_skills = dict(ranked.filter(ranking_id__in=previous_skills).values_list("ranking_id", "skill"))
+        entries.filter(ranking_id__in=previous_skills, position__isnull=False).exclude(
+            ranking_id__in=current_skills
+        ).update(position=None)
+        skills = [skill for skill in previous_skills.values() if skill is not None] + list(current_skills.values())
+        if not skills:
+            return
+        low, high = min(skills), max(skills)
+        in_range = ranked.filter(skill__gte=low, skill__lte=high)
+        # Positions above the range don't change
+        above = ranked.filter(skill__gt=high).order_by("skill", "-player_id").values_list("position", flat=True)
+        first_position += above.first() or 0
+    # Players with the same skill are ordered by id, so that the positions are stable
+    positions = in_range.order_by("-skill", "player_id").values_list("ranking_id", "position")
+    changed = []
+    position = first_position
+    for ranking_id, previous_position in positions:
+        if position != previous_position:
+            changed.append(LeaderboardEntry(ranking_id=ranking_id, position=position))
+        position += 1
+    LeaderboardEntry.objects.bulk_update(changed, ["position"], batch_size=BULK_BATCH_SIZE)
+
+    if previous_skills is not None:
+        below = entries.filter(skill__lt=low, position__isnull=False)
+        previous_next_position = below.order_by("-skill", "player_id").values_list("position", flat=True).first()
+        if previous_next_position is not None and previous_next_position != position:
+            below.update(position=F("position") + (position - previous_next_position))
+
+
+def after_checkpoint(checkpoint: RatingCheckpoint, session_id_field: str = "id") -> Q:
+    """Filter for the sessions (or checkpoints) that come after the given checkpoint.
+
+    Sessions are processed in order of (datetime, id), so that is also the order of the checkpoints.
+    """
+    return Q(datetime__gt=checkpoint.datetime) | Q(
+        datetime=checkpoint.datetime, **{f"{session_id_field}__gt": checkpoint.session_id}
+    )
+
+
+def save_checkpoints(activity_id: str, checkpoints: CheckpointRecorder) -> None:
+    """Write the snapshots recorded during a replay to the database."""
+    RatingCheckpoint.objects.bulk_create(
+        (
+            RatingCheckpoint(
+                activity_id=activity_id,
+                session_id=session_id,
+                datetime=datetime,
+                ratings=ratings,
+                start=checkpoints.start,
+            )
+            for session_id, datetime, ratings in checkpoints.snapshots
+        ),
+        batch_size=BULK_BATCH_SIZE,
+    )
+
+
+def update_ratings(  # noqa: PLR0913
+    activity_id: str,
+    games: List[GameRecord],
+    ratings: Dict[int, Rating],
+    progress: Optional[ProgressCallback] = None,
+    checkpoints: Optional[CheckpointRecorder] = None,
+    save_all: bool = True,  # noqa: FBT001,FBT002
+) -> Dict[int, Rating]:
+    """Update the given ratings with the results of the given games and save the rankings and skill history.
+
+    The rankings of all the given players are saved, unless `save_all` is False, in which case only the rankings of
+    players who played in the games are saved.
+    """
+    if checkpoints is None:
+        checkpoints = CheckpointRecorder(settings.RATING_CHECKPOINT_INTERVAL)
+    ratings_before = dict(ratings)
+    history = replay_games(games, ratings, progress, checkpoints)
+    deltas = last_match_deltas(history, ratings_before)
+    changed_ratings = ratings if save_all else {player_id: ratings[player_id] for player_id in deltas}
+    with transaction.atomic():
+        save_skill_history(activity_id, history)
+        save_rankings(activity_id, changed_ratings)
+        save_checkpoints(activity_id, checkpoints)
+        refresh_leaderboard(activity_id, deltas, None if save_all else changed_ratings.keys())
+    return ratings
+
+
+def start_of_date(date: Tuple[int, int, int]) -> int:
+    """Get the (local) time at the start of a date."""
+    return int(time.mktime((*date, 0, 0, 0, 0, 0, 0)))
+
+
+def full_replay_checkpoints(interval: int, start: Optional[int]) -> CheckpointRecorder:
+    """Create the checkpoint recorder of a full recalculation (of the matches from the given start time, if any)."""
+    sessions_since_checkpoint = 0
+    if start is not None and interval > 0:
+        # Also record a snapshot after the first session, so that it's always known which matches the ratings include
+        sessions_since_checkpoint = interval - 1
+    return CheckpointRecorder(interval, sessions_since_checkpoint, start)
+
+
+def start_full_recalculation(activity: Activity, after_date: Optional[Tuple[int, int, int]] = None) -> SessionReplay:
+    """Clear the skill history and checkpoints of an activity to replay all its sessions (or those after a date)."""
+    ratings = generate_blank_ratings(activity)
+    sessions = GameSession.objects.filter(activity=activity, validated=1)
+    start = None
+    if after_date is not None:
+        start = start_of_date(after_date)
+        sessions = sessions.filter(datetime__gte=start)
+    with transaction.atomic():
+        # Clear skill history and checkpoints that will be reconstructed
+        SkillHistory.objects.filter(activity=activity).delete()
+        RatingCheckpoint.objects.filter(activity=activity).delete()
+
+    checkpoints = full_replay_checkpoints(settings.RATING_CHECKPOINT_INTERVAL, start)
+    return SessionReplay(activity.id, sessions, ratings, checkpoints, dict.fromkeys(ratings, 0.0))
+
+
+def batch_update_player_skills(
+    activity_id: str,
+    after_date: Optional[Tuple[int, int, int]] = None,
+    progress: Optional[ProgressCallback] = None,
+) -> None:
+    """Do a full/batch update of player skills for a specific activity.
+
+    This will wipe all current rankings and recalculate them and the SkillHistory's from scratch,
+    reconsidering the whole history of games played (or only those after a certain, given, date).
+    The sessions are replayed a chunk at a time (see `SessionReplay`), and the rankings are replaced at the end.
+    """
+    start_full_recalculation(Activity.objects.get(id=activity_id), after_date).run(progress)
+
+
+class ParallelRecalculation:
+    """Full recalculations of several activities, with a chunk of a different activity replayed in each process."""
+
+    def __init__(self, executor: ProcessPoolExecutor, activities: Iterable[Activity]):
+        self.executor = executor
+        self.activities = iter(activities)
+        # The replay and number of games of the chunk that each process is replaying
+        self.replaying: Dict["Future[ReplayedChunk]", Tuple[SessionReplay, int]] = {}
+
+    def submit_next_chunk(self, replay: SessionReplay) -> bool:
+        """Submit the next chunk of a replay to a process, or finish the replay if there are no chunks left."""
+        games = replay.next_chunk()
+        if games is None:
+            replay.finish()
+            return False
+        future = self.executor.submit(replay_chunk, games, replay.ratings, replay.checkpoints, replay.fast_kernel)
+        self.replaying[future] = (replay, len(games))
+        return True
+
+    def start_next_activity(self) -> None:
+        """Start replaying the next activity that has any games (if any are left)."""
+        for activity in self.activities:
+            if self.submit_next_chunk(start_full_recalculation(activity)):
+                return
+
+    def save_done_chunks(self, timeout: float) -> int:
+        """Wait (up to a timeout) for chunks to be replayed, save them and submit the next ones.
+
+        Returns the number of games that were saved.
+        """
+        done, _ = wait(self.replaying, timeout=timeout, return_when=FIRST_COMPLETED)
+        saved_games = 0
+        for future in done:
+            replay, game_count = self.replaying.pop(future)
+            replay.save_chunk(future.result())
+            saved_games += game_count
+            if not self.submit_next_chunk(replay):
+                self.start_next_activity()
+        return saved_games
+
+
+def recalculate_all_activities(max_workers: Optional[int] = None, progress: Optional[ProgressCallback] = None) -> int:
+    """Do a full update of player skills for all activities, with chunks of their sessions replayed in other processes.
+
+    Each activity is replayed a chunk at a time (see `SessionReplay`), with a chunk of a different activity in each
+    process. Chunks are loaded and their results saved by this process, while the other processes only do the
+    calculations, so that at most one chunk per process is kept in memory. Returns the number of activities that were
+    updated.
+    """
+    activities = list(Activity.objects.filter(gamesession__validated=1).distinct().order_by("id"))
+    total_games = Game.objects.filter(session__activity__in=activities, session__validated=1).count()
+    processed_games = 0
+    if progress is not None:
+        progress(processed_games, total_games)
+    # Don't share open database connections with the new processes
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=django.setup) as executor:
+        recalculation = ParallelRecalculation(executor, activities)
+        for _ in range(max_workers or os.cpu_count() or 1):
+            recalculation.start_next_activity()
+        while recalculation.replaying:
+            processed_games += recalculation.save_done_chunks(PROGRESS_WAIT_TIMEOUT)
+            if progress is not None:
+                # Also reported while waiting, so that the job's heartbeat is kept up to date
+                progress(processed_games, total_games)
+    return len(activities)
+
+
+def recalculate_player_skills_from(
+    activity_id: str, from_datetime: int, progress: Optional[ProgressCallback] = None
+) -> None:
+    """Recalculate player skills after a change to sessions at (or after) the given time.
+
+    Ratings are restored from the closest checkpoint before the change, so that only the sessions after it need to be
+    replayed. Falls back to a full recalculation when no such checkpoint exists. The ratings keep including the same
+    matches, i.e. if they were recalculated from a certain date, only matches after that date are still included.
+    The sessions are replayed a chunk at a time (see `SessionReplay`).
+    """
+    activity = Activity.objects.get(id=activity_id)
+    checkpoints = RatingCheckpoint.objects.filter(activity=activity).order_by("-datetime", "-session_id")
+    latest_checkpoint = checkpoints.defer("ratings").first()
+    start = latest_checkpoint.start if latest_checkpoint is not None else None
+    checkpoint = checkpoints.filter(datetime__lt=from_datetime, start=start).first()
+    if checkpoint is None:
+        after_date = time.localtime(start)[:3] if start is not None else None
+        batch_update_player_skills(activity_id, after_date, progress=progress)  # type: ignore[arg-type]
+        return
+
+    ratings = generate_blank_ratings(activity)
+    ratings.update(unpack_ratings(checkpoint.ratings))
+    sessions = GameSession.objects.filter(activity=activity).filter(after_checkpoint(checkpoint))
+    with transaction.atomic():
+        # Clear skill history (even of sessions that are no longer valid) and checkpoints that will be reconstructed
+        SkillHistory.objects.filter(activity=activity, result__game__session__in=sessions.values("id")).delete()
+        RatingCheckpoint.objects.filter(activity=activity).filter(after_checkpoint(checkpoint, "session_id")).delete()
+
+    checkpoints = CheckpointRecorder(settings.RATING_CHECKPOINT_INTERVAL, start=start)
+    SessionReplay(activity.id, sessions.filter(validated=1), ratings, checkpoints).run(progress)
+
+
+def get_common_activity(game_sessions: Any) -> Optional[Activity]:
+    """Get the activity in common between a list (or QuerySet) of GameSessions."""
+    if isinstance(game_sessions, QuerySet):
+        # Avoid loading the activity of each session separately.
+        activity_ids = list(game_sessions.order_by().values_list("activity_id", flat=True).distinct()[:2])
+        if len(activity_ids) != 1:
+            return None
+        return Activity.objects.filter(id=activity_ids[0]).first()
+
+    activity = game_sessions[0].activity
+    # Check that all session are from the same activity
+    for session in game_sessions:
+        if session.activity.id != activity.id:
+            return None
+    return cast(Activity, activity)
+
+
+def get_ratings_for_all_players(activity):
+    """Generate ratings for all known players, even new ones that haven't yet participated in activity.
+
+    We generate empty ratings for all players and then fill-in all the known ratings.
+    """
+    # Generate rankings for everyone since some people might not have rankings already
+    current_ratings = generate_blank_ratings(activity)
+    # Set the values for everyone that already has a ranking
+    for player_id, mu, sigma in Ranking.objects.filter(activity_id=activity.id).values_list("player_id", "mu", "sigma"):
+        if player_id not in current_ratings:
+            raise ValueError("Unknown player")
+        current_ratings[player_id] = Rating(mu, sigma)
+    return current_ratings
+
+
+def get_ratings_for_players(activity: Activity, player_ids: Iterable[int]) -> Dict[int, Rating]:
+    """Get the current ratings of the given players (with the initial rating for those without rankings)."""
+    ratings = {player_id: new_rating(activity) for player_id in player_ids}
+    for player_id, mu, sigma in Ranking.objects.filter(activity_id=activity.id, player_id__in=ratings).values_list(
+        "player_id", "mu", "sigma"
+    ):
+        ratings[player_id] = Rating(mu, sigma)
+    return ratings
+
+
+def incremental_update_player_skills(
+    new_game_sessions: Any, current_ratings: Optional[Dict[int, Rating]] = None
+) -> Optional[Dict[int, Rating]]:
+    """Incrementally update player skills by considering only the given new set of games.
+
+    Unless the current ratings are given, only the rankings of the players in the games are loaded and saved, so that
+    the cost depends on the size of the games rather than on the number of players.
+    """
+    if not new_game_sessions.exists():
+        return current_ratings
+
+    activity = get_common_activity(new_game_sessions)
+    if activity is None:
+        raise ValueError("Unknown activity")
+
+    # Continue counting sessions from the latest checkpoint so that new checkpoints are still recorded periodically
+    latest_checkpoint = (
+        RatingCheckpoint.objects.filter(activity=activity).order_by("-datetime", "-session_id").defer("ratings").first()
+    )
+    validated_sessions = GameSession.objects.filter(activity=activity, validated=1)
+    if latest_checkpoint is not None:
+        validated_sessions = validated_sessions.filter(after_checkpoint(latest_checkpoint))
+    start = latest_checkpoint.start if latest_checkpoint is not None else None
+    checkpoints = CheckpointRecorder(settings.RATING_CHECKPOINT_INTERVAL, validated_sessions.count(), start)
+
+    games = load_games(new_game_sessions)
+    if current_ratings is not None:
+        # Process each match (chronologically) to calculate rating progress and determine final rankings
+        return update_ratings(activity.id, games, current_ratings, checkpoints=checkpoints)
+
+    player_ids = {player_id for game in games for team in game.teams for player_id in team}
+    session_count = len({game.session_id for game in games})
+    if checkpoints.interval > 0 and checkpoints.sessions_since_checkpoint + session_count >= checkpoints.interval:
+        # Snapshots have to include the ratings of all players that have rankings
+        ratings = get_ratings_for_players(
+            activity, Ranking.objects.filter(activity=activity).values_list("player_id", flat=True)
+        )
+        ratings.update(get_ratings_for_players(activity, player_ids - ratings.keys()))
+    else:
+        ratings = get_ratings_for_players(activity, player_ids)
+    return update_ratings(activity.id, games, ratings, checkpoints=checkpoints, save_all=False)
@@ -0,0 +1,101 @@
+"""In-process registry of all activities, so that views can look them up (by ID or URL) without querying the database.
+
+Activities rarely change, so each process loads them once and keeps them until an activity is saved or deleted. The
+`post_save`/`post_delete` signals clear the registry of the process that made the change and (once the change is
+committed) increase a version number in Django's cache, which other processes compare to the version they loaded.
+When the cache isn't shared between processes (i.e. without `DJANGO_CACHE_DIR`), other processes instead reload the
+activities once they're older than `settings.ACTIVITY_REGISTRY_TTL` seconds.
+
+The activities are shared by all requests (and threads) of a process and shouldn't be modified.
+"""
+
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Activity
+
+# Key (in Django's cache) of the version of the activities, which is increased whenever they change.
+VERSION_KEY = "previous.registry.version"
+
+
+class Snapshot(NamedTuple):
+    """All activities as loaded at some point."""
+
+    version: int
+    expires: float
+    activities: List[Activity]
+    by_id: Dict[str, Activity]
+    by_url: Dict[str, Activity]
+
+
+def get_version() -> int:
+    """Get the current version of the activities (shared by all processes if the cache is)."""
+    return cache.get(VERSION_KEY, 0)  # type: ignore[no-any-return]
+
+
+def increase_version() -> None:
+    """Increase the version of the activities so that all processes reload them."""
+    cache.add(VERSION_KEY, 0, timeout=None)
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # Expired (or cleared) since it was added
+        cache.set(VERSION_KEY, 1, timeout=None)
+
+
+class ActivityRegistry:
+    """Thread-safe registry of all activities (see the module's description)."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        # Replaced as a whole (never modified), so that each lookup sees a consistent set of activities
+        self.snapshot: Optional[Snapshot] = None
+
+    def get_snapshot(self) -> Snapshot:
+        """Get all activities, (re)loading them if they've changed or expired."""
+        snapshot = self.snapshot
+        version = get_version()
+        if snapshot is None or snapshot.version != version or snapshot.expires <= time.monotonic():
+            activities = list(Activity.objects.all())
+            snapshot = Snapshot(
+                version=version,
+                expires=time.monotonic() + self.ttl,
+                activities=activities,
+                by_id={activity.id: activity for activity in activities},
+                by_url={activity.url: activity for activity in activities},
+            )
+            self.snapshot = snapshot
+        return snapshot
+
+    def all(self) -> List[Activity]:
+        """Get all activities, in the same order as the database returns them."""
+        return self.get_snapshot().activities
+
+    def active(self) -> List[Activity]:
+        """Get the active activities (e.g. to list in the navigation bar)."""
+        return [activity for activity in self.get_snapshot().activities if activity.active]
+
+    def get(self, activity_id: str) -> Optional[Activity]:
+        """Get an activity by its ID."""
+        return self.get_snapshot().by_id.get(activity_id)
+
+    def get_by_url(self, url: str) -> Optional[Activity]:
+        """Get an activity by its URL."""
+        return self.get_snapshot().by_url.get(url)
+
+    def resolve_id(self, activity_url: str) -> str:
+        """Get the ID of the activity with the given URL (or ID, since the API accepts either)."""
+        activity = self.get_by_url(activity_url)
+        return activity.id if activity is not None else activity_url
+
+    def invalidate(self, sender: Any = None, **kwargs: Any) -> None:
+        """Reload the activities when they're next used (handler of signals for changes to activities)."""
+        self.snapshot = None
+        transaction.on_commit(increase_version)
+
+
+registry = ActivityRegistry(settings.ACTIVITY_REGISTRY_TTL)
@@ -0,0 +1,191 @@
+"""Background resolution of the hostnames of the IP addresses that submit matches.
+
+Reverse DNS lookups can take seconds when they fail, so they are never done while handling a request. Submissions
+are stored with the raw IP address as their `submittor`, while its hostname is looked up in a background thread and
+then back-filled into the sessions that were submitted, e.g. "10.0.0.1" becomes "10.0.0.1 (host.example.com)". Results
+(including failed lookups) are cached for a while so that each address is only looked up once in that time.
+"""
+
+import logging
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .cache import bump_data_versions
+from .models import Game, GameSession, Result
+
+logger = logging.getLogger(__name__)
+
+# Number of threads used for lookups.
+RESOLVER_THREADS = 2
+
+
+def lookup_hostname(ip: str) -> Optional[str]:
+    """Look up the hostname of an IP address (blocks until the lookup is done or fails)."""
+    try:
+        # getfqdn() won't throw exception, but then we can't differentiate when it
+        # works, and we might generate e.g. "127.0.0.1 (127.0.0.1)"
+        return socket.gethostbyaddr(ip)[0]
+    except OSError:
+        return None
+
+
+def format_submittor(ip: str, hostname: Optional[str]) -> str:
+    """Generate the string used to identify a submittor, e.g. "10.0.0.1 (host.example.com)"."""
+    if hostname is None:
+        return ip
+    return f"{ip} ({hostname})"
+
+
+def submittor_ip(submittor: str) -> str:
+    """Get the IP address of a submittor (see `format_submittor`)."""
+    return submittor.split(" (", 1)[0]
+
+
+class HostnameCache:
+    """Thread-safe cache of hostnames (or failed lookups) that expire after a while.
+
+    The least recently used entries are removed once the cache is full.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # Hostname (None for failed lookups) and expiry time per IP address
+        self.entries: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+
+    def get(self, ip: str) -> Tuple[bool, Optional[str]]:
+        """Get whether an address is cached and, if so, its hostname."""
+        with self.lock:
+            entry = self.entries.get(ip)
+            if entry is None:
+                return False, None
+            if entry[1] <= time.monotonic():
+                del self.entries[ip]
+                return False, None
+            self.entries.move_to_end(ip)
+            return True, entry[0]
+
+    def put(self, ip: str, hostname: Optional[str]) -> None:
+        """Cache the hostname of an address."""
+        with self.lock:
+            self.entries[ip] = (hostname, time.monotonic() + self.ttl)
+            self.entries.move_to_end(ip)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+def backfill_submittor(ip: str, hostname: Optional[str], session_ids: Iterable[int]) -> int:
+    """Replace submittors of the given sessions that are only the given address with its hostname.
+
+    Only the sessions (and their games and results) are changed, so that they're found by their IDs instead of by
+    comparing the submittor of every row. Returns the number of rows changed.
+    """
+    session_ids = list(session_ids)
+    if hostname is None or len(session_ids) == 0:
+        return 0
+    submittor = format_submittor(ip, hostname)
+    rows_per_model = (
+        GameSession.objects.filter(id__in=session_ids),
+        Game.objects.filter(session_id__in=session_ids),
+        Result.objects.filter(game__session_id__in=session_ids),
+    )
+    with transaction.atomic():
+        changed = sum(rows.filter(submittor=ip).update(submittor=submittor) for rows in rows_per_model)
+        if changed > 0:
+            # Submittors are shown in the (cached) lists of matches
+            bump_data_versions(GameSession.objects.filter(id__in=session_ids).values_list("activity_id", flat=True))
+    return changed
+
+
+class HostnameResolver:
+    """Resolves hostnames in background threads and back-fills them into submissions."""
+
+    def __init__(self, cache: HostnameCache, lookup: Callable[[str], Optional[str]] = lookup_hostname):
+        self.cache = cache
+        self.lookup = lookup
+        self.lock = threading.Lock()
+        # IDs of the sessions to back-fill per address that is being looked up
+        self.pending: Dict[str, Set[int]] = {}
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    def describe(self, ip: str) -> str:
+        """Identify the submittor with the given address without waiting for its hostname to be looked up.
+
+        The hostname is only included if it's cached (see `resolve_after_commit` for looking it up).
+        """
+        cached, hostname = self.cache.get(ip)
+        if cached:
+            return format_submittor(ip, hostname)
+        return ip
+
+    def resolve_after_commit(self, submittor: str, session_ids: Iterable[int]) -> None:
+        """Look up the hostname of a submittor in the background once the current transaction is committed.
+
+        Call this after recording the given sessions, so that the hostname can be back-filled once their rows exist
+        (outside of a transaction the lookup is started immediately). Nothing is done if the submittor already includes
+        the hostname, or if looking it up failed.
+        """
+        ip = submittor_ip(submittor)
+        # A hostname can be cached after the submittor was described (in which case it's still back-filled)
+        if submittor != ip or self.cache.get(ip) == (True, None):
+            return
+        session_ids = list(session_ids)
+        transaction.on_commit(lambda: self.schedule(ip, session_ids))
+
+    def schedule(self, ip: str, session_ids: Iterable[int]) -> None:
+        """Start looking up the hostname of an address in the background to back-fill it into the given sessions.
+
+        The sessions are added to those of the lookup if the address is already being looked up.
+        """
+        with self.lock:
+            pending = self.pending.get(ip)
+            if pending is not None:
+                pending.update(session_ids)
+                return
+            self.pending[ip] = set(session_ids)
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(RESOLVER_THREADS, thread_name_prefix="resolver")
+        self.executor.submit(self.resolve_in_background, ip)
+
+    def get_hostname(self, ip: str) -> Optional[str]:
+        """Get the hostname of an address from the cache, or look it up (and cache it)."""
+        cached, hostname = self.cache.get(ip)
+        if not cached:
+            hostname = self.lookup(ip)
+            self.cache.put(ip, hostname)
+        return hostname
+
+    def resolve(self, ip: str, session_ids: Iterable[int]) -> Optional[str]:
+        """Look up (unless cached), cache and back-fill the hostname of an address into the given sessions."""
+        hostname = self.get_hostname(ip)
+        backfill_submittor(ip, hostname, session_ids)
+        return hostname
+
+    def resolve_in_background(self, ip: str) -> None:
+        """Resolve an address in a background thread for all the sessions scheduled so far (see `schedule`)."""
+        try:
+            hostname = self.get_hostname(ip)
+        except Exception:
+            logger.exception("Failed to resolve hostname of %s", ip)
+            hostname = None
+        # Sessions that are scheduled from now on are resolved by another lookup (which uses the cache)
+        with self.lock:
+            session_ids = self.pending.pop(ip)
+        try:
+            backfill_submittor(ip, hostname, session_ids)
+        except Exception:
+            logger.exception("Failed to back-fill hostname of %s", ip)
+        finally:
+            # Each thread has its own database connection which isn't closed at the end of a request
+            connection.close()
+
+
+resolver = HostnameResolver(HostnameCache(settings.HOSTNAME_CACHE_SIZE, settings.HOSTNAME_CACHE_TTL))
@@ -0,0 +1,74 @@
+"""Downsampling of time series (such as a player's skill history) to the number of points that can be shown.
+
+Each function selects the indices of the points to keep (always including the first and last points), so that the
+other values of the selected points can be returned along with them.
+"""
+
+from typing import Callable, Dict, List, Sequence
+
+# Minimum number of points to select (the first and last, and at least one in between)
+MIN_THRESHOLD = 3
+
+
+def lttb(xs: Sequence[float], ys: Sequence[float], threshold: int) -> List[int]:
+    """Select points with the Largest-Triangle-Three-Buckets algorithm (which preserves the visual shape of a series).
+
+    The points between the first and last are split into `threshold - 2` buckets, and from each bucket the point is
+    selected that forms the largest triangle with the previously selected point and the average of the next bucket.
+    See: https://skemman.is/handle/1946/15343
+    """
+    n = len(xs)
+    if n <= threshold:
+        return list(range(n))
+    if threshold < MIN_THRESHOLD:
+        raise ValueError(f"At least {MIN_THRESHOLD} points have to be selected")
+
+    bucket_size = (n - 2) / (threshold - 2)
+    selected = [0]
+    prev = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+        # Average of the next bucket (or the last point)
+        next_end = min(int((bucket + 2) * bucket_size) + 1, n)
+        next_x = sum(xs[end:next_end]) / (next_end - end) if next_end > end else xs[n - 1]
+        next_y = sum(ys[end:next_end]) / (next_end - end) if next_end > end else ys[n - 1]
+
+        x0, y0 = xs[prev], ys[prev]
+        prev = max(range(start, end), key=lambda i: abs((x0 - next_x) * (ys[i] - y0) - (x0 - xs[i]) * (next_y - y0)))
+        selected.append(prev)
+    selected.append(n - 1)
+    return selected
+
+
+def min_max(xs: Sequence[float], ys: Sequence[float], threshold: int) -> List[int]:
+    """Select the lowest and highest point in each bucket (which preserves the extremes of a series)."""
+    n = len(xs)
+    if n <= threshold:
+        return list(range(n))
+    if threshold < MIN_THRESHOLD:
+        raise ValueError(f"At least {MIN_THRESHOLD} points have to be selected")
+
+    # The first and last points are always selected, and then 2 points per bucket (or 1 if there's no space)
+    buckets = max((threshold - 2) // 2, 1)
+    bucket_size = (n - 2) / buckets
+    selected = [0]
+    for bucket in range(buckets):
+        indices = range(int(bucket * bucket_size) + 1, int((bucket + 1) * bucket_size) + 1)
+        if len(indices) == 0:
+            continue
+        lowest, highest = min(indices, key=ys.__getitem__), max(indices, key=ys.__getitem__)
+        if threshold == MIN_THRESHOLD:
+            # Keep whichever extreme is furthest from the first point
+            selected.append(max(lowest, highest, key=lambda i: abs(ys[i] - ys[0])))
+        else:
+            selected.extend(sorted({lowest, highest}))
+    selected.append(n - 1)
+    return selected
+
+
+# Available downsampling methods (by name)
+DOWNSAMPLERS: Dict[str, Callable[[Sequence[float], Sequence[float], int], List[int]]] = {
+    "lttb": lttb,
+    "minmax": min_max,
+}
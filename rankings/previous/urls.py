@@ -26,12 +26,20 @@ urlpatterns = [
     re_path(r"^api/validate_all$", api.validate_all_matches),
     re_path(r"^(?P<activity_url>.+)/api/add_matches$", api.submit_match),
     re_path(r"^(?P<activity_url>.+)/api/undo_submission$", api.undo_submit),
+    re_path(r"^api/skill-series/(?P<activity_url>[^/]+)/(?P<player_id>\d+)/$", api.skill_series, name="skill_series"),
+    re_path(r"^api/dashboard/(?P<activity_url>[^/]+)/$", api.dashboard, name="dashboard"),
+    re_path(
+        r"^api/export/(?P<activity_url>[^/]+)/(?P<table>matches|skill-history)\.(?P<file_format>ndjson|csv)$",
+        views.export_history,
+        name="export_history",
+    ),
     path("api/", include(router.urls)),
     re_path(
         r"^admin_api/select_player_to_fix/(?P<session_ids_str>.*)$",
         views.select_player_to_replace_in_submissions,
         name="select_fix_player",
     ),
+    re_path(r"^admin_api/jobs/(?P<job_id>[0-9]+)$", views.job_status, name="job_status"),
     re_path(r"^admin_api/(?P<activity_url>.+)/update$", views.update, name="update_rankings"),
     re_path(
         r"^admin_api/(?P<activity_url>.+)/update/(?P<year>[0-9]+)$",
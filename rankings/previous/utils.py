@@ -1,10 +1,32 @@
 """Utility functions."""
 
-from typing import TYPE_CHECKING, Any, List, Literal, Optional, Protocol, Type, TypedDict
+import base64
+import binascii
+import json
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Literal,
+    Optional,
+    Protocol,
+    Sequence,
+    Tuple,
+    Type,
+    TypedDict,
+    Union,
+)
 
+from django.db.models import F, OrderBy, Q, QuerySet
+from drf_link_header_pagination import LinkHeaderLimitOffsetPagination
 from rest_framework import authentication, serializers
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.request import Request
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class CsrfExemptSessionAuthentication(authentication.SessionAuthentication):
@@ -64,6 +86,14 @@ if TYPE_CHECKING:  # pragma: no cover
 
         def get_serializer_class(self: Any) -> Type[Any]: ...  # noqa: D102
 
+        def get_queryset(self: Any) -> Any: ...  # noqa: D102
+
+        def filter_queryset(self: Any, queryset: Any) -> Any: ...  # noqa: D102
+
+        def paginate_queryset(self: Any, queryset: Any) -> Any: ...  # noqa: D102
+
+        def get_paginated_response(self: Any, data: Any) -> Any: ...  # noqa: D102
+
     class FieldFilterMixinProtocol(Protocol):
         """Protocol for FieldFilterMixin."""
 
@@ -86,27 +116,90 @@ class FieldFilterMixin(ModelViewSetProtocol):
     # Name of the query parameter to use for filtering fields."""
     field_filter_param: Optional[str] = None
 
+    def get_selected_fields(self) -> Optional[Tuple[str, ...]]:
+        """Get the fields requested with the field filter parameter (or None if all fields should be returned)."""
+        fields = self.request.query_params.get(self.field_filter_param)
+        if self.field_filter_param is None or fields is None:
+            return None
+        if fields == "":
+            raise ValidationError(f"query parameter '{self.field_filter_param}' is empty")
+
+        selected = tuple(fields.split(","))
+        # Check all the fields are valid.
+        all_fields = self.get_serializer_class().Meta.fields
+        if not set(selected).issubset(all_fields):
+            invalid_fields = list(set(selected) - set(all_fields))
+            raise ValidationError(
+                f"query parameter '{self.field_filter_param}' referenced invalid fields: {invalid_fields}"
+            )
+        return selected
+
     def get_serializer(self, *args: Any, **kwargs: Any) -> serializers.Serializer:
         """Return the serializer instance to be used."""
-        fields = self.request.query_params.get(self.field_filter_param)
+        fields = self.get_selected_fields()
         # Filter fields returned in output.
-        if self.field_filter_param is not None and fields is not None:
-            if fields == "":
-                raise ValidationError(f"query parameter '{self.field_filter_param}' is empty")
-
-            fields = tuple(fields.split(","))
-            # Check all the fields are valid.
-            all_fields = self.get_serializer_class().Meta.fields
-            if not set(fields).issubset(all_fields):
-                invalid_fields = list(set(fields) - set(all_fields))
-                raise ValidationError(
-                    f"query parameter '{self.field_filter_param}' referenced invalid fields: {invalid_fields}"
-                )
-
+        if fields is not None:
             return super().get_serializer(*args, fields=fields, **kwargs)  # type: ignore
         return super().get_serializer(*args, **kwargs)  # type: ignore
 
 
+# Lookups of the values of the fields of an item (see `ValuesListMixin.values_fields`).
+ValuesSpec = Dict[str, Union[str, "ValuesSpec"]]
+
+
+def values_lookups(spec: ValuesSpec) -> List[str]:
+    """List the lookups of the values of all (nested) fields."""
+    lookups: List[str] = []
+    for lookup in spec.values():
+        lookups.extend([lookup] if isinstance(lookup, str) else values_lookups(lookup))
+    return lookups
+
+
+def build_from_values(values: Dict[str, Any], spec: ValuesSpec) -> Dict[str, Any]:
+    """Build the (nested) representation of an item from its values (as returned by `QuerySet.values()`)."""
+    return {
+        field: values[lookup] if isinstance(lookup, str) else build_from_values(values, lookup)
+        for field, lookup in spec.items()
+    }
+
+
+class ValuesListMixin(FieldFilterMixin):
+    """Mixin that lists items by building their representation straight from `.values()`.
+
+    Serializers create a model instance (and run every field's conversions) for each item, and nested serializers
+    query each related object separately. For read-only lists of simple fields this can instead be done with a single
+    query of only the values that are needed. `values_fields` has to give the same output as the serializer: it maps
+    each of the serializer's fields to the lookup of its value, or to the lookups of the fields of a nested object
+    (which can't be null).
+
+    Use with a class extending `rest_framework.viewsets.ModelViewSet`. Other actions still use the serializer.
+    """
+
+    values_fields: Optional[ValuesSpec] = None
+
+    def get_values_spec(self) -> ValuesSpec:
+        """Get the lookups of the values of the fields to list (in the serializer's order)."""
+        assert self.values_fields is not None  # noqa: S101
+        all_fields: Iterable[str] = self.get_serializer_class().Meta.fields
+        selected = self.get_selected_fields()
+        return {field: self.values_fields[field] for field in all_fields if selected is None or field in selected}
+
+    def list(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        """List items."""
+        if self.values_fields is None:
+            return super().list(request, *args, **kwargs)  # type: ignore[misc]
+        spec = self.get_values_spec()
+        # Pagination might also need the values by which items are ordered (see `KeysetPagination`)
+        keyset_fields = getattr(self.paginator, "keyset_fields", ())
+        queryset = self.filter_queryset(self.get_queryset())
+        values = queryset.values(*dict.fromkeys([*values_lookups(spec), *keyset_fields]))
+        page = self.paginate_queryset(values)
+        items = [build_from_values(item, spec) for item in (values if page is None else page)]
+        if page is None:
+            return Response(items)
+        return self.get_paginated_response(items)
+
+
 class ValidateParamsMixin(ModelViewSetProtocol, FieldFilterMixinProtocol):
     """Mixin for validating query parameters.
 
@@ -157,6 +250,156 @@ OpenAPIParameters = TypedDict(
 )
 
 
+class KeysetPagination(LinkHeaderLimitOffsetPagination):
+    """Link header pagination that continues after the last item of the previous page (instead of at an offset).
+
+    Items are ordered by `keyset_fields` (ascending, or descending if ordered by "-" and the first field), and the
+    `next`/`prev` links contain a cursor with the values of those fields for the last/first item of the page. Each
+    page is then found with an (indexed) comparison instead of skipping all the preceding items, and the items aren't
+    counted, so that pages take the same time to load regardless of how deep they are.
+
+    Requests with an `offset` (or ordered by other fields) are still paginated by `LinkHeaderLimitOffsetPagination`,
+    which includes a `last` link (since it counts the items).
+
+    All fields but the last can be null: null values come first in ascending order and last in descending order (as in
+    SQLite's indexes, so that the order is still given by an index).
+    """
+
+    cursor_query_param = "cursor"
+    # Integer fields by which items are ordered, the last of which has to be unique (and not null).
+    keyset_fields: Tuple[str, ...] = ("datetime", "id")
+
+    def paginate_queryset(self, queryset: QuerySet, request: Request, view: Any = None) -> Optional[List[Any]]:
+        """Get a page of items."""
+        ordering = request.query_params.get(api_settings.ORDERING_PARAM) or self.keyset_fields[0]
+        self.keyset = (
+            self.offset_query_param not in request.query_params and ordering.lstrip("-") == (self.keyset_fields[0])
+        )
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)  # type: ignore[no-any-return]
+
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.descending = ordering.startswith("-")
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor[0]
+        # Items are read in reverse when going to the previous page
+        descending = self.descending != reverse
+        if self.cursor is not None:
+            queryset = queryset.filter(self.after(self.cursor[1], descending=descending))
+        items = list(queryset.order_by(*self.get_ordering(descending=descending))[: self.limit + 1])
+
+        self.has_more = len(items) > self.limit
+        items = items[: self.limit]
+        if reverse:
+            items.reverse()
+        self.first_key = self.get_key(items[0]) if items else None
+        self.last_key = self.get_key(items[-1]) if items else None
+        return items
+
+    def get_ordering(self, *, descending: bool) -> List[OrderBy]:
+        """Get the ordering of the items (in the given direction), with null values first in ascending order."""
+        *nullable, unique = self.keyset_fields
+        if descending:
+            return [*(F(field).desc(nulls_last=True) for field in nullable), F(unique).desc()]
+        return [*(F(field).asc(nulls_first=True) for field in nullable), F(unique).asc()]
+
+    def after(self, key: Sequence[Any], *, descending: bool) -> Q:
+        """Build a filter for items that come after the given key (in the given direction)."""
+        lookup = "lt" if descending else "gt"
+        condition = Q()
+        # A null value is equal to (and so filtered by) `field=None`, i.e. `field__isnull=True`
+        equal: Dict[str, Any] = {}
+        for field, value in zip(self.keyset_fields, key):
+            if value is None:
+                # Only non-null values come after null values (in ascending order)
+                if not descending:
+                    condition |= Q(**equal, **{f"{field}__isnull": False})
+            else:
+                condition |= Q(**equal, **{f"{field}__{lookup}": value})
+                if descending and field != self.keyset_fields[-1]:
+                    # Null values come after all others (in descending order)
+                    condition |= Q(**equal, **{f"{field}__isnull": True})
+            equal[field] = value
+        return condition
+
+    def get_key(self, item: Any) -> List[Any]:
+        """Get the values of the fields by which an item (a model instance or its values) is ordered."""
+        if isinstance(item, dict):
+            return [item[field] for field in self.keyset_fields]
+        return [getattr(item, field) for field in self.keyset_fields]
+
+    def encode_cursor(self, key: Sequence[Any], *, reverse: bool) -> str:
+        """Generate the URL of the page before (reverse) or after the given key."""
+        cursor = base64.urlsafe_b64encode(json.dumps([reverse, list(key)]).encode()).decode()
+        url = remove_query_param(self.request.build_absolute_uri(), self.offset_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)  # type: ignore[no-any-return]
+
+    def decode_cursor(self, request: Request) -> Optional[Tuple[bool, List[Any]]]:
+        """Get whether the cursor in the request is for a previous page and the key it continues from."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            reverse, key = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError) as e:
+            raise NotFound("Invalid cursor") from e
+        if not isinstance(reverse, bool) or not isinstance(key, list) or len(key) != len(self.keyset_fields):
+            raise NotFound("Invalid cursor")
+        # Only the last value can't be null
+        if not all(
+            (isinstance(value, int) and not isinstance(value, bool)) or (value is None and idx < len(key) - 1)
+            for idx, value in enumerate(key)
+        ):
+            raise NotFound("Invalid cursor")
+        return reverse, key
+
+    def get_next_link(self) -> Optional[str]:
+        """Get the URL of the next page."""
+        if not self.keyset:
+            return super().get_next_link()  # type: ignore[no-any-return]
+        reverse = self.cursor is not None and self.cursor[0]
+        # There's a next page if there were more items, or if we came from it
+        if self.last_key is None or not (reverse or self.has_more):
+            return None
+        return self.encode_cursor(self.last_key, reverse=False)
+
+    def get_previous_link(self) -> Optional[str]:
+        """Get the URL of the previous page."""
+        if not self.keyset:
+            return super().get_previous_link()  # type: ignore[no-any-return]
+        reverse = self.cursor is not None and self.cursor[0]
+        if self.first_key is None or not (self.has_more if reverse else self.cursor is not None):
+            return None
+        return self.encode_cursor(self.first_key, reverse=True)
+
+    def get_first_link(self) -> Optional[str]:
+        """Get the URL of the first page."""
+        url = super().get_first_link()
+        return remove_query_param(url, self.cursor_query_param)  # type: ignore[no-any-return]
+
+    def get_last_link(self) -> Optional[str]:
+        """Get the URL of the last page (only known when using an offset, since items aren't counted otherwise)."""
+        if self.keyset:
+            return None
+        return super().get_last_link()  # type: ignore[no-any-return]
+
+    def get_schema_operation_parameters(self, view: Any) -> List[OpenAPIParameters]:
+        """Get the (OpenAPI) parameters used for pagination."""
+        return [
+            *super().get_schema_operation_parameters(view),
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Cursor of the page to return (from the `next` or `prev` links of another page).",
+                "schema": {"type": "string"},
+            },
+        ]
+
+
 def cardinal_to_ordinal(num: int) -> str:
     """Convert a cardinal number (how many) to an ordinal number string (which position)."""
     suffix = {
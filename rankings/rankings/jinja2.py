@@ -2,11 +2,15 @@
 """Jinja configurations."""
 
 import json
+import os
 from typing import Any, Dict, List, Optional
 
+from django.conf import settings
 from django.contrib.staticfiles.storage import staticfiles_storage
+from django.template import engines
+from django.template.backends.jinja2 import Jinja2
 from django.urls import reverse
-from jinja2 import Environment
+from jinja2 import Environment, FileSystemBytecodeCache
 
 
 def no_op(with_categories: bool = False, category_filter: Optional[List[str]] = None) -> None:  # noqa
@@ -30,8 +34,16 @@ def url_for(endpoint: str, **values: Dict[str, Any]) -> str:
     return reverse(endpoint, kwargs=values)
 
 
-def environment(**options: Dict[str, Any]) -> Environment:
-    """Define Jinja environment configurations."""
+def environment(**options: Any) -> Environment:
+    """Define Jinja environment configurations.
+
+    Templates are only checked for changes in DEBUG mode. If `settings.JINJA2_BYTECODE_CACHE_DIR` is set, compiled
+    templates are stored in that folder, so that they're only compiled once for all processes (and restarts).
+    """
+    options.setdefault("auto_reload", settings.DEBUG)
+    if settings.JINJA2_BYTECODE_CACHE_DIR and "bytecode_cache" not in options:
+        os.makedirs(settings.JINJA2_BYTECODE_CACHE_DIR, exist_ok=True)
+        options["bytecode_cache"] = FileSystemBytecodeCache(settings.JINJA2_BYTECODE_CACHE_DIR)
     # TODO: enable autoescape - see: https://stackoverflow.com/questions/17257138/cant-disable-the-autoescape-in-jinja2
     env = Environment(**options)  # type: ignore # noqa: S701
     env.globals.update(
@@ -46,3 +58,17 @@ def environment(**options: Dict[str, Any]) -> Environment:
     # env.filters['url_for'] = url_for
     # jinja2.filters.FILTERS['url_for'] = url_for
     return env
+
+
+def precompile_templates() -> List[str]:
+    """Compile (or load from the bytecode cache) all Jinja templates, so that the first requests don't have to.
+
+    Returns the names of the templates.
+    """
+    names = []
+    for engine in engines.all():
+        if isinstance(engine, Jinja2):
+            for name in engine.env.list_templates():
+                engine.env.get_template(name)
+                names.append(name)
+    return names
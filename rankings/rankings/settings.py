@@ -128,7 +128,7 @@ WSGI_APPLICATION = "rankings.wsgi.application"
 REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.AllowAny"],
     "DEFAULT_RENDERER_CLASSES": (
-        "rest_framework.renderers.JSONRenderer",
+        "previous.renderers.FastJSONRenderer",
         "rest_framework.renderers.BrowsableAPIRenderer",
     ),
     "DEFAULT_FILTER_BACKENDS": [
@@ -157,10 +157,66 @@ DB_PATH = os.getenv("DJANGO_DB_PATH")
 DB_FILE = os.getenv("DJANGO_DB_FILENAME", "db.sqlite3")
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
+        # Django's SQLite backend, with the transaction mode option of later Django versions (see `previous.backend`)
+        "ENGINE": "previous.backend",
         "NAME": os.path.join(DB_PATH or BASE_DIR, DB_FILE),
+        "OPTIONS": {
+            # Transactions take the write lock when they start (waiting for other writers for up to the busy timeout),
+            # so that transactions that read before writing don't fail when another connection writes in between
+            "transaction_mode": os.getenv("DJANGO_SQLITE_TRANSACTION_MODE", "IMMEDIATE"),
+        },
+    }
+}
+# Pragmas set on each new SQLite connection (an empty value leaves SQLite's default). WAL mode allows reads while
+# writing, and writers wait up to the busy timeout (in milliseconds) for each other instead of failing immediately.
+# See: https://www.sqlite.org/pragma.html
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("DJANGO_SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("DJANGO_SQLITE_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": os.getenv("DJANGO_SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)),
+    # Negative values are in KiB instead of pages
+    "cache_size": os.getenv("DJANGO_SQLITE_CACHE_SIZE", str(-64 * 1024)),
+    "busy_timeout": os.getenv("DJANGO_SQLITE_BUSY_TIMEOUT", "5000"),
+    "temp_store": os.getenv("DJANGO_SQLITE_TEMP_STORE", "MEMORY"),
+}
+
+# Cache of responses (per version of each activity's data). A file-based cache is shared by all processes, while the
+# default local-memory cache is per process.
+# See: https://docs.djangoproject.com/en/4.2/topics/cache/
+CACHE_DIR = os.getenv("DJANGO_CACHE_DIR")
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache"
+        if CACHE_DIR
+        else "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": CACHE_DIR or "rankings",
     }
 }
+# Number of seconds that responses are cached (0 to disable caching)
+RESPONSE_CACHE_TIMEOUT = int(os.getenv("DJANGO_RESPONSE_CACHE_TIMEOUT", "3600"))
+# Folder in which compiled Jinja templates are stored (and shared by all processes), if any
+JINJA2_BYTECODE_CACHE_DIR = os.getenv("DJANGO_JINJA2_BYTECODE_CACHE_DIR") or (
+    os.path.join(CACHE_DIR, "jinja2") if CACHE_DIR else None
+)
+# Maximum number of seconds that each process keeps activities (when the cache isn't shared between processes)
+ACTIVITY_REGISTRY_TTL = float(os.getenv("DJANGO_ACTIVITY_REGISTRY_TTL", "300"))
+
+# Number of sessions between each snapshot of all ratings that is stored to speed up recalculations (0 to disable)
+RATING_CHECKPOINT_INTERVAL = int(os.getenv("DJANGO_RATING_CHECKPOINT_INTERVAL", "100"))
+# Number of sessions whose games are loaded (and whose skill history is saved) at a time when replaying many sessions
+RATING_REPLAY_CHUNK_SIZE = int(os.getenv("DJANGO_RATING_REPLAY_CHUNK_SIZE", "1000"))
+# Implementation used for updating ratings: "trueskill" (default) or "numpy" (faster, but requires NumPy)
+RATING_KERNEL = os.getenv("DJANGO_RATING_KERNEL", "trueskill")
+# Number of processes used when recalculating all activities at once (defaults to the number of CPUs)
+RATING_WORKERS = int(os.getenv("DJANGO_RATING_WORKERS", "0")) or None
+
+# Number of seconds without any progress (heartbeat) after which a running recalculation job is considered to be
+# abandoned (e.g. due to a crashed worker) and is queued again when a worker starts
+RECALCULATION_JOB_TIMEOUT = float(os.getenv("DJANGO_RECALCULATION_JOB_TIMEOUT", "3600"))
+
+# Maximum number of hostnames (of submittors' IP addresses) to cache and for how long (in seconds)
+HOSTNAME_CACHE_SIZE = int(os.getenv("DJANGO_HOSTNAME_CACHE_SIZE", "1024"))
+HOSTNAME_CACHE_TTL = float(os.getenv("DJANGO_HOSTNAME_CACHE_TTL", "3600"))
 
 # See: https://docs.djangoproject.com/en/3.2/releases/3.2/#customizing-type-of-auto-created-primary-keys
 DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "rankings.settings")
 
 application = get_wsgi_application()
+
+# Compile templates when each worker starts (instead of on their first requests)
+from rankings.jinja2 import precompile_templates  # noqa: E402
+
+precompile_templates()
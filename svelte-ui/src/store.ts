@@ -1,6 +1,12 @@
 import { writable } from 'svelte/store';
 import { asyncDerived } from '@square/svelte-store';
-import { DefaultDict, readJSONAPI, readJSONAPIList, type PageableAPIStore } from '$lib/api';
+import {
+	DefaultDict,
+	readJSONAPI,
+	readJSONAPIList,
+	type HeaderAPIStore,
+	type PageableAPIStore
+} from '$lib/api';
 
 export const currentActivityUrl = writable<string | null>(null);
 // Title used for breadcrumbs in the navbar.
@@ -109,6 +115,22 @@ export const apiPendingMatches = function (
 	return _apiPendingMatches[addPagingToURL(url, pageNr, limit)];
 };
 
+/** Stores for the summary of an activity **/
+export interface Dashboard {
+	activity: { id: string; url: string; name: string };
+	top_players: { id: number; name: string; skill: number; position: number; delta: number | null }[];
+	recent_matches: Matches[];
+	pending_matches: Matches[];
+	players: { id: number; name: string }[];
+}
+export const dashboardAPIStore = function (activity_url: string) {
+	return readJSONAPI<Dashboard | null>(null, `/api/dashboard/${activity_url}/`);
+};
+// A shared store of the dashboard of each activity (with everything shown on its summary page).
+export const apiDashboard = new DefaultDict(dashboardAPIStore) as {
+	[key: string]: HeaderAPIStore<Dashboard | null>;
+};
+
 /** Stores for single matches **/
 export const generateSingleMatchAPIStore = function <T>(url: string) {
 	return readJSONAPI<T | null>(null, url);